@@ -1,411 +1,213 @@
-from flask import Flask, request, render_template, send_file, flash, redirect, url_for
+from flask import Blueprint, Flask, Request, Response, request, g, current_app, render_template, send_file, flash, redirect, url_for, jsonify, stream_with_context
 import os
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
-from docx import Document
-from docx.shared import Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.section import WD_SECTION
-from docx.table import Table, _Cell
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
-import tempfile
-import zipfile
-import shutil
 import io
-import re
-from docx.text.paragraph import Paragraph
-from docx.table import Table
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
+from formatter import FORMATTER_VERSION, STREAMING_MIN_SIZE, FormatOptions, format_docx_job
+from document_template import load_template, template_key
+from fragment_cache import shared_fragment_cache_stats
+from heading_rules import load_rules, rules_key
+from preflight import plan_layout
+from metrics import FormatterMetrics
+from jobs import JobQueue, QueueFullError
+from batch import stream_batch_zip, valid_manifest
+from result_cache import ResultCache, cache_key
+from workspace import QuotaExceededError, WorkspaceManager
+import json
+import logging
+import random
+import uuid
+import zipfile
+
+class FormatterRequest(Request):
+    @property
+    def max_content_length(self):
+        # Whole-conference archives are far larger than a single paper
+        if self.endpoint == 'formatter.batch_upload':
+            return current_app.config['BATCH_MAX_CONTENT_LENGTH']
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Keep uploads in memory unless they are larger than SPOOL_MAX_SIZE, then in the request's workspace
+        return g.workspace.spooled_file(current_app.config['SPOOL_MAX_SIZE'])
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+bp = Blueprint('formatter', __name__)
 
-# Create upload directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def create_app(config=None):
+    """Create the formatter app; *config* overrides any of the defaults below"""
+    app = Flask(__name__)
+    app.request_class = FormatterRequest
+    app.config['SECRET_KEY'] = 'your-secret-key-here'
+    app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # 64MB max file size
+    app.config['SPOOL_MAX_SIZE'] = 8 * 1024 * 1024  # Uploads above 8MB spill to a file in the request's workspace
+    app.config['WORKSPACE_DIR'] = None  # Parent directory of the per-request workspaces; None uses the system temp dir
+    app.config['DISK_QUOTA_BYTES'] = 1024 * 1024 * 1024  # Disk that spilled uploads may hold at once before answering 503
+    app.config['WORKSPACE_TTL'] = 3600  # Seconds before a workspace left behind by a killed process is swept
+    app.config['JOB_WORKERS'] = None  # Defaults to one worker process per CPU
+    app.config['JOB_QUEUE_DEPTH'] = 32  # Unfinished jobs accepted before answering 429
+    app.config['JOB_RESULT_TTL'] = 600  # Seconds a finished job's result is kept
+    app.config['BATCH_MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # 512MB max archive size for /batch
+    app.config['RESULT_CACHE_MAX_BYTES'] = 256 * 1024 * 1024  # Byte budget for cached results
+    app.config['RESULT_CACHE_DIR'] = None  # Keep cached results on disk here instead of in memory
+    app.config['IMAGE_TARGET_DPI'] = None  # Downsample larger pictures to this DPI at their display size, e.g. 200; None keeps originals
+    app.config['STREAMING_MIN_SIZE'] = STREAMING_MIN_SIZE  # Inputs this large are formatted with the streaming backend
+    app.config['TEMPLATE_PATH'] = None  # House template .docx for the output's styles and page setup; None uses python-docx's default
+    app.config['HEADING_RULES_PATH'] = None  # Heading rules file (see heading_rules.py); None uses heading_rules.json
+    app.config['PRESERVE_RUN_FORMATTING'] = False  # Keep inline bold/italic/sub/superscript/font changes in body text and references
+    app.config['FRAGMENT_CACHE_MAX_BYTES'] = 0  # Per-process budget for reusable formatted blocks, e.g. 64MB for revisions; 0 disables
+    app.config['PARALLEL_MIN_SIZE'] = 0  # Uploads this large are formatted in chunks on the job workers; 0 disables
+    app.config['PROFILE_SAMPLE_RATE'] = 0.0  # Fraction of documents formatted under cProfile, with the profile logged
+    app.config.update(config or {})
+    app.logger.setLevel(logging.INFO)
+
+    app.extensions['result_cache'] = ResultCache(
+        max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+        directory=app.config['RESULT_CACHE_DIR'],
+    )
+    app.extensions['job_queue'] = JobQueue(
+        max_workers=app.config['JOB_WORKERS'],
+        max_pending=app.config['JOB_QUEUE_DEPTH'],
+        result_ttl=app.config['JOB_RESULT_TTL'],
+    )
+    app.extensions['workspaces'] = WorkspaceManager(
+        root=app.config['WORKSPACE_DIR'],
+        quota_bytes=app.config['DISK_QUOTA_BYTES'],
+        ttl=app.config['WORKSPACE_TTL'],
+    )
+    app.extensions['formatter_metrics'] = FormatterMetrics()
+
+    # Parse the output template and heading rules now, so a bad file fails start-up rather than the first request
+    load_template(app.config['TEMPLATE_PATH'])
+    load_rules(app.config['HEADING_RULES_PATH'])
+
+    app.register_blueprint(bp)
+    return app
 
 ALLOWED_EXTENSIONS = {'docx'}
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# The current app's shared state
+result_cache = LocalProxy(lambda: current_app.extensions['result_cache'])
+job_queue = LocalProxy(lambda: current_app.extensions['job_queue'])
+workspaces = LocalProxy(lambda: current_app.extensions['workspaces'])
+formatter_metrics = LocalProxy(lambda: current_app.extensions['formatter_metrics'])
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/favicon.ico')
+@bp.route('/favicon.ico')
 def favicon():
     return '', 204  # No content response for favicon
 
-def add_page_numbers_and_footer(section, footer_text=""):
-    """Add page numbers and custom footer text to the document"""
-    try:
-        # Create footer
-        footer = section.footer
-        footer_para = footer.paragraphs[0]
-        
-        # Clear existing content
-        footer_para.clear()
-        
-        if footer_text.strip():
-            # Set paragraph format with tab stops
-            pPr = footer_para._element.get_or_add_pPr()
-            
-            # Add tab stops - one for right alignment
-            tabs = OxmlElement('w:tabs')
-            tab = OxmlElement('w:tab')
-            tab.set(qn('w:val'), 'right')
-            tab.set(qn('w:pos'), '9360')  # 6.5 inches in twentieths of a point
-            tabs.append(tab)
-            pPr.append(tabs)
-            
-            # Add page number on the left
-            page_run = footer_para.add_run("Page ")
-            page_run.font.size = Inches(0.14)
-            
-            # Add page number field
-            fldChar1 = OxmlElement('w:fldChar')
-            fldChar1.set(qn('w:fldCharType'), 'begin')
-            
-            instrText = OxmlElement('w:instrText')
-            instrText.text = "PAGE"
-            
-            fldChar2 = OxmlElement('w:fldChar')
-            fldChar2.set(qn('w:fldCharType'), 'end')
-            
-            page_run._element.append(fldChar1)
-            page_run._element.append(instrText)
-            page_run._element.append(fldChar2)
-            
-            # Add tab character to move to right side
-            tab_run = footer_para.add_run("\t")
-            
-            # Add custom footer text on the right
-            footer_run = footer_para.add_run(footer_text)
-            footer_run.font.size = Inches(0.14)
-            
-        else:
-            # Just page number
-            page_num_run = footer_para.add_run("Page ")
-            page_num_run.font.size = Inches(0.14)
-            
-            # Add page number field
-            fldChar1 = OxmlElement('w:fldChar')
-            fldChar1.set(qn('w:fldCharType'), 'begin')
-            
-            instrText = OxmlElement('w:instrText')
-            instrText.text = "PAGE"
-            
-            fldChar2 = OxmlElement('w:fldChar')
-            fldChar2.set(qn('w:fldCharType'), 'end')
-            
-            page_num_run._element.append(fldChar1)
-            page_num_run._element.append(instrText)
-            page_num_run._element.append(fldChar2)
-        
-    except Exception as e:
-        print(f"Error adding page numbers and footer: {e}")
-        pass
-
-def configure_section(section, columns=1, footer_text=""):
-    """Configure margins, columns, and footer for a section"""
-    section.top_margin = Inches(1)
-    section.bottom_margin = Inches(1)
-    section.left_margin = Inches(0.75)
-    section.right_margin = Inches(0.75)
-    
-    # Set up columns
-    sectPr = section._sectPr
-    # Clear existing columns if any
-    cols_elements = sectPr.xpath('./w:cols')
-    for cols in cols_elements:
-        sectPr.remove(cols)
-        
-    cols = OxmlElement('w:cols')
-    cols.set(qn('w:num'), str(columns))
-    cols.set(qn('w:space'), '720')  # 0.5 inch space between columns
-    sectPr.append(cols)
-    
-    # Add page numbers and footer
-    add_page_numbers_and_footer(section, footer_text)
+def format_options():
+    """FormatOptions for the current app's configuration"""
+    config = current_app.config
+    return FormatOptions(config['IMAGE_TARGET_DPI'], config['TEMPLATE_PATH'], config['STREAMING_MIN_SIZE'],
+                         config['HEADING_RULES_PATH'], config['FRAGMENT_CACHE_MAX_BYTES'],
+                         config['PRESERVE_RUN_FORMATTING'], config['PARALLEL_MIN_SIZE'])
 
-def get_optimal_image_size(image_path, max_width_inches=4.5):
-    """Calculate optimal image size based on aspect ratio and available space"""
-    try:
-        from PIL import Image
-        with Image.open(image_path) as img:
-            width, height = img.size
-            aspect_ratio = height / width
-            
-            # Calculate optimal width (max 4.5 inches to fit better in document)
-            optimal_width = min(max_width_inches, 4.5)
-            optimal_height = optimal_width * aspect_ratio
-            
-            # If height is too large, adjust based on height constraint
-            if optimal_height > 3:  # Max 3 inches height
-                optimal_height = 3
-                optimal_width = optimal_height / aspect_ratio
-            
-            # Ensure minimum readable size
-            if optimal_width < 2:
-                optimal_width = 2
-                optimal_height = optimal_width * aspect_ratio
-            
-            return Inches(optimal_width), Inches(optimal_height)
-    except Exception as e:
-        print(f"PIL not available or error processing image: {e}")
-        # Default smaller size if PIL is not available
-        return Inches(4), Inches(3)
+def sample_profile():
+    """Return True for the PROFILE_SAMPLE_RATE fraction of documents that should be profiled"""
+    return random.random() < current_app.config['PROFILE_SAMPLE_RATE']
+
+def record_document(source, outcome, stats=None, request_id=None, **fields):
+    """Count one document in the formatter metrics and log it as a single JSON line"""
+    formatter_metrics.observe(source, outcome, stats)
+    record = {'event': 'document', 'request_id': request_id, 'source': source, 'outcome': outcome}
+    record.update(fields)
+    if stats:
+        record['seconds'] = round(stats['seconds'], 4)
+        record['stages'] = {stage: round(seconds, 4) for stage, seconds in stats['stages'].items()}
+        record['counts'] = stats['counts']
+        record['image_bytes_saved'] = stats.get('image_bytes_saved', 0)
+        if stats.get('rules'):
+            record['rules'] = {rule: hits for rule, (hits, _) in stats['rules'].items()}
+        if 'fragment_reuse' in stats:
+            record['fragment_reuse'] = round(stats['fragment_reuse'], 4)
+    current_app.logger.info(json.dumps(record))
+    if stats and stats.get('profile'):
+        current_app.logger.info(f"Profile for request {request_id}:\n{stats['profile']}")
 
-def iter_block_items(parent):
+def result_cache_key(data, footer_text=""):
+    """Return the result cache key for *data* under the current formatter version and settings"""
+    options = format_options()
+    version = (f"{FORMATTER_VERSION}/dpi={options.image_dpi}/template={template_key(options.template)}"
+               f"/rules={rules_key(options.heading_rules)}/preserve={options.preserve_formatting}")
+    return cache_key(data, footer_text, version)
+
+def format_docx_cached(data, footer_text="", request_id=None, source_path=None):
     """
-    Yield each paragraph and table child within *parent*, in document order.
-    Each returned value is an instance of either Table or Paragraph.
-    *parent* would most commonly be a Document object.
+    Format the DOCX bytes *data* under the app's settings and return the output bytes. The
+    result cache answers for an input formatted before, and the document is counted and
+    logged under *request_id* either way. *source_path* is a file already holding *data*,
+    such as a spilled upload, for the chunk workers of a parallel run to read. A parallel
+    run raises QueueFullError rather than start while the job queue is full.
     """
-    from docx.document import Document as DocumentClass
-    if isinstance(parent, DocumentClass):
-        parent_elm = parent.element.body
-    elif isinstance(parent, _Cell):
-        parent_elm = parent._tc
-    else:
-        raise ValueError("Unknown parent type")
-
-    for child in parent_elm.iterchildren():
-        if isinstance(child, CT_P):
-            yield Paragraph(child, parent)
-        elif isinstance(child, CT_Tbl):
-            yield Table(child, parent)
-
-def copy_table(src_table, dest_doc):
-    """Copy a table from source to destination document with preservation of text and basic formatting"""
-    new_table = dest_doc.add_table(rows=len(src_table.rows), cols=len(src_table.columns))
-    new_table.style = src_table.style
-    
-    # Copy alignment and column widths if possible
-    for r_idx, row in enumerate(src_table.rows):
-        for c_idx, cell in enumerate(row.cells):
-            new_cell = new_table.rows[r_idx].cells[c_idx]
-            # Copy text and formatting by copying paragraphs
-            first_p = True
-            for p in cell.paragraphs:
-                if first_p:
-                    new_p = new_cell.paragraphs[0]
-                    new_p.text = "" # clear default
-                    first_p = False
-                else:
-                    new_p = new_cell.add_paragraph()
-                
-                for run in p.runs:
-                    new_run = new_p.add_run(run.text)
-                    new_run.bold = run.bold
-                    new_run.italic = run.italic
-                    if run.font.size:
-                        new_run.font.size = run.font.size
-                    if run.font.name:
-                        new_run.font.name = run.font.name
-
-def process_docx(input_path, output_path, footer_text=""):
-    """Process DOCX file to make headings bold and arrange content in 2 columns"""
+    options = format_options()
+    formatted = []
+
+    def compute():
+        # Jobs already run one per worker, so only uploads formatted here split a document across them
+        executor = None
+        if options.parallel_min_size and len(data) >= options.parallel_min_size:
+            # The chunks count as pending jobs, so a parallel run only starts while the queue has room
+            if job_queue.full:
+                raise QueueFullError(f"{job_queue.pending} jobs already pending")
+            executor = job_queue.task_executor
+        output, stats = format_docx_job(data, footer_text, options, sample_profile(), executor,
+                                        input_path=source_path, workspace=g.workspace)
+        formatted.append(stats)
+        return output
+
     try:
-        # Open the document
-        doc = Document(input_path)
-        
-        # Create new document for output
-        new_doc = Document()
-        
-        # Configure initial section as 1-column for title
-        configure_section(new_doc.sections[0], columns=1, footer_text=footer_text)
-        current_columns = 1
-        title_found = False
-        
-        in_references = False
-        
-        # Extract images from the original document
-        image_dict = extract_images_from_docx(input_path)
-        
-        # Process all block items (paragraphs and tables) in order
-        for block in iter_block_items(doc):
-            if isinstance(block, Paragraph):
-                text = block.text.strip()
-                
-                # Check for images in this paragraph
-                has_images = False
-                for run in block.runs:
-                    if 'graphicData' in run._element.xml or 'pic:pic' in run._element.xml:
-                        has_images = True
-                        break
-                
-                if has_images:
-                    # Images usually follow current layout
-                    new_para = new_doc.add_paragraph()
-                    new_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    
-                    image_added = False
-                    # Try to add images from extracted files
-                    if image_dict:
-                        try:
-                            image_key = list(image_dict.keys())[0]
-                            image_path = image_dict[image_key]
-                            new_run = new_para.add_run()
-                            width, height = get_optimal_image_size(image_path)
-                            new_run.add_picture(image_path, width=width, height=height)
-                            image_added = True
-                            del image_dict[image_key]
-                        except Exception as img_error:
-                            print(f"Could not add image: {img_error}")
-                    
-                    if not image_added:
-                        new_para.add_run("[Image placeholder]")
-                    
-                    if text:
-                        caption_para = new_doc.add_paragraph(text)
-                        caption_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in caption_para.runs:
-                            run.font.size = Inches(0.12)
-                            run.italic = True
-                    
-                    new_doc.add_paragraph()
-                    continue
-
-                if not text:
-                    continue
-
-                # Check if this is references section
-                if 'REFERENCES' in text.upper() or 'BIBLIOGRAPHY' in text.upper():
-                    in_references = True
-                    heading_para = new_doc.add_paragraph()
-                    heading_run = heading_para.add_run(text)
-                    heading_run.bold = True
-                    heading_run.font.size = Inches(0.16)
-                    heading_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    new_doc.add_paragraph()
-                    continue
-
-                # Handle references
-                if in_references and text and not text.isupper():
-                    ref_para = new_doc.add_paragraph()
-                    ref_para.style = 'List Number'
-                    ref_para.add_run(text)
-                    continue
-
-                # Improved heading detection
-                # Main Heading: UPPERCASE text with more than 1 word
-                is_uppercase_heading = text.isupper() and len(text.split()) > 1
-                
-                # Special Blocks: Abstract or Keywords (Stay in 2 columns but are bold)
-                is_special_block = (
-                    text.upper().startswith('ABSTRACT') or 
-                    text.upper().startswith('KEYWORDS')
-                )
-                
-                # Subheading: Numbered lists or specific keywords
-                is_subheading = (
-                    re.match(r'^(\d+|[A-ZIVX]+)[\.\)]\s+', text) or
-                    (len(text.split()) <= 8 and any(word in text.upper() for word in ['INTRODUCTION', 'CONCLUSION', 'CHAPTER', 'SECTION', 'METHODOLOGY', 'RESULT', 'DISCUSSION', 'ABSTRACT', 'KEYWORDS'])) or
-                    text.endswith(':') or
-                    (text.isupper() and len(text.split()) <= 1) # Single word uppercase like "AIM"
-                )
-
-                if is_uppercase_heading and not title_found: 
-                    # ONLY the FIRST uppercase heading spans 1 row (full width)
-                    title_found = True
-                    # Switch to 1 column if not already
-                    if current_columns != 1:
-                        new_section = new_doc.add_section(WD_SECTION.CONTINUOUS)
-                        configure_section(new_section, columns=1, footer_text=footer_text)
-                        current_columns = 1
-                    
-                    heading_para = new_doc.add_paragraph()
-                    heading_run = heading_para.add_run(text)
-                    heading_run.bold = True
-                    heading_run.font.size = Inches(0.18)
-                    heading_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    new_doc.add_paragraph()
-                elif is_uppercase_heading or is_special_block or is_subheading:
-                    # Subsequent uppercase headings, Abstract/Keywords, and Subheadings stay in 2 columns
-                    if current_columns != 2:
-                        new_section = new_doc.add_section(WD_SECTION.CONTINUOUS)
-                        configure_section(new_section, columns=2, footer_text=footer_text)
-                        current_columns = 2
-                        
-                    heading_para = new_doc.add_paragraph()
-                    heading_run = heading_para.add_run(text)
-                    heading_run.bold = True
-                    heading_run.font.size = Inches(0.14)
-                    
-                    if is_special_block:
-                        heading_para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    else:
-                        heading_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                        
-                    new_doc.add_paragraph()
-                else:
-                    # Normal paragraph - ensure in 2 columns
-                    if current_columns != 2:
-                        new_section = new_doc.add_section(WD_SECTION.CONTINUOUS)
-                        configure_section(new_section, columns=2, footer_text=footer_text)
-                        current_columns = 2
-                        
-                    new_para = new_doc.add_paragraph(text)
-                    new_para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    new_para.paragraph_format.space_after = Inches(0.1)
-            
-            elif isinstance(block, Table):
-                # Copy table to new document
-                copy_table(block, new_doc)
-                new_doc.add_paragraph() # spacing after table
-
-        # Clean up extracted images
-        for img_path in image_dict.values():
-            try:
-                os.remove(img_path)
-            except: pass
-        
-        new_doc.save(output_path)
-        return True
-    except Exception as e:
-        print(f"Error processing document: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False
-def extract_images_from_docx(docx_path):
-    """Extract images from DOCX file and return dict of image paths"""
-    image_dict = {}
-    temp_dir = tempfile.mkdtemp()
-    
+        output = result_cache.get_or_compute(result_cache_key(data, footer_text), compute)
+    except QueueFullError:
+        record_document('upload', 'rejected', request_id=request_id)
+        raise
+    except Exception:
+        record_document('upload', 'error', request_id=request_id)
+        raise
+    if formatted:
+        record_document('upload', 'ok', formatted[0], request_id=request_id)
+    else:
+        record_document('upload', 'cached', request_id=request_id)
+    return output
+
+@bp.before_app_request
+def assign_request_id():
+    # Reuse the caller's ID so log lines can be joined with the proxy's
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+@bp.before_app_request
+def open_workspace():
+    # A body past SPOOL_MAX_SIZE may spill to disk, so it is only admitted while the quota has room for it
+    size = request.content_length
+    if size is None and request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        size = request.max_content_length
+    size = size or 0
     try:
-        # Extract DOCX as ZIP
-        with zipfile.ZipFile(docx_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        
-        # Find media folder
-        media_path = os.path.join(temp_dir, 'word', 'media')
-        if os.path.exists(media_path):
-            for filename in os.listdir(media_path):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                    image_path = os.path.join(media_path, filename)
-                    # Copy to temp location
-                    temp_image_path = os.path.join(tempfile.gettempdir(), f"temp_{filename}")
-                    shutil.copy2(image_path, temp_image_path)
-                    image_dict[filename] = temp_image_path
-    
-    except Exception as e:
-        print(f"Error extracting images: {e}")
-    
-    finally:
-        # Clean up temp directory
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass
-    
-    return image_dict
+        g.workspace = workspaces.open(size if size > current_app.config['SPOOL_MAX_SIZE'] else 0)
+    except QuotaExceededError:
+        response = jsonify(error='Server is busy, please retry shortly')
+        response.headers['Retry-After'] = '30'
+        return response, 503
 
+@bp.teardown_app_request
+def close_workspace(exc):
+    workspace = g.pop('workspace', None)
+    if workspace is not None:
+        workspace.close()
 
-@app.route('/')
+@bp.after_app_request
+def add_request_id(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         flash('No file selected')
@@ -420,26 +222,206 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-        
-        # Create output filename
         name, ext = os.path.splitext(filename)
         output_filename = f"{name}_processed{ext}"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        
-        # Process the document
-        if process_docx(input_path, output_path, footer_text):
-            # Clean up input file
-            os.remove(input_path)
-            return send_file(output_path, as_attachment=True, download_name=output_filename)
-        else:
+
+        # Identical uploads (same bytes and footer) are served from the result cache
+        try:
+            # An upload spilled to the workspace is read by parallel chunk workers from where it is
+            source_path = file.stream.path if getattr(file.stream, 'rolled', False) else None
+            result = format_docx_cached(file.read(), footer_text, request_id=g.request_id,
+                                        source_path=source_path)
+        except QuotaExceededError:
+            # No room in the disk quota for the copy the chunk workers read
+            response = jsonify(error='Server is busy, please retry shortly')
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        except QueueFullError:
+            response = jsonify(error='Too many documents queued, please retry shortly')
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        except Exception:
             flash('Error processing document')
-            os.remove(input_path)
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
+
+        return send_file(io.BytesIO(result), as_attachment=True, download_name=output_filename,
+                         mimetype=DOCX_MIMETYPE)
     else:
         flash('Invalid file type. Please upload a .docx file')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify(error='No file selected'), 400
+    if not allowed_file(file.filename):
+        return jsonify(error='Invalid file type. Please upload a .docx file'), 400
+
+    footer_text = request.form.get('footer_text', '')
+    filename = secure_filename(file.filename)
+    data = file.read()
+    key = result_cache_key(data, footer_text)
+    cached = result_cache.get(key)
+    request_id = g.request_id
+    app = current_app._get_current_object()
+
+    def job_done(future):
+        # Runs on the pool's result thread once the worker has finished
+        with app.app_context():
+            try:
+                output, stats = future.result()
+            except Exception as e:
+                record_document('job', 'error', request_id=request_id, filename=filename, error=str(e))
+                return
+            result_cache.put(key, output)
+            record_document('job', 'ok', stats, request_id=request_id, filename=filename)
+
+    try:
+        if cached is not None:
+            job_id = job_queue.add_finished((cached, None), filename=filename)
+            record_document('job', 'cached', request_id=request_id, filename=filename)
+        else:
+            job_id = job_queue.submit(format_docx_job, data, footer_text, format_options(),
+                                      sample_profile(), filename=filename, key=key, on_done=job_done)
+    except QueueFullError:
+        formatter_metrics.observe('job', 'rejected')
+        response = jsonify(error='Too many documents queued, please retry shortly')
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    return jsonify(
+        job_id=job_id,
+        status_url=url_for('.job_status', job_id=job_id),
+        download_url=url_for('.download_job', job_id=job_id),
+    ), 202
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error='Unknown job'), 404
+    return jsonify(status)
+
+@bp.route('/jobs/<job_id>/download')
+def download_job(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error='Unknown job'), 404
+    if status['status'] == 'failed':
+        return jsonify(error=status['error']), 500
+    if status['status'] != 'done':
+        return jsonify(status), 409
+
+    name, ext = os.path.splitext(status['filename'])
+    output, _ = job_queue.result(job_id)
+    return send_file(io.BytesIO(output), as_attachment=True,
+                     download_name=f"{name}_processed{ext}",
+                     mimetype=DOCX_MIMETYPE)
+
+@bp.route('/preflight', methods=['POST'])
+def preflight():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify(error='No file selected'), 400
+    if not allowed_file(file.filename):
+        return jsonify(error='Invalid file type. Please upload a .docx file'), 400
+
+    # Only the body is read, straight from the upload stream
+    filename = secure_filename(file.filename)
+    try:
+        plan = plan_layout(file.stream, current_app.config['HEADING_RULES_PATH'])
+    except Exception as e:
+        record_document('preflight', 'error', request_id=g.request_id, filename=filename, error=str(e))
+        return jsonify(error='Could not read document'), 400
+    stats = {'seconds': plan['seconds'], 'stages': {}, 'counts': {}, 'rules': plan['rules']}
+    record_document('preflight', 'ok', stats, request_id=g.request_id, filename=filename)
+    return jsonify(filename=filename, **plan)
+
+@bp.route('/batch', methods=['POST'])
+def batch_upload():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify(error='No file selected'), 400
+    if not file.filename.lower().endswith('.zip'):
+        return jsonify(error='Invalid file type. Please upload a .zip of .docx files'), 400
+
+    # A manifest.json from an interrupted batch skips the documents it already holds
+    previous_manifest = None
+    manifest_file = request.files.get('manifest')
+    if manifest_file is not None and manifest_file.filename:
+        try:
+            previous_manifest = json.load(manifest_file)
+        except ValueError:
+            return jsonify(error='Invalid manifest'), 400
+        # Checked now: once the zip starts streaming, an error can only cut it short
+        if not valid_manifest(previous_manifest):
+            return jsonify(error='Invalid manifest'), 400
+
+    try:
+        archive = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        return jsonify(error='Invalid zip archive'), 400
+
+    footer_text = request.form.get('footer_text', '')
+    name, _ = os.path.splitext(secure_filename(file.filename))
+    request_id = g.request_id
+
+    def batch_entry(entry):
+        record_document('batch', entry['status'], entry_stats(entry), request_id=request_id,
+                        filename=entry['name'], error=entry['error'])
+
+    chunks = stream_batch_zip(archive, job_queue.executor, footer_text, previous_manifest,
+                              options=format_options(),
+                              profile_rate=current_app.config['PROFILE_SAMPLE_RATE'], on_entry=batch_entry)
+    return Response(stream_with_context(chunks), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={name}_processed.zip'})
+
+def entry_stats(entry):
+    """Rebuild the stats dict of a batch manifest entry, or None if it has none"""
+    if 'stages' not in entry:
+        return None
+    return {
+        'seconds': entry['seconds'],
+        'stages': entry['stages'],
+        'counts': entry['counts'],
+        'image_bytes_saved': entry.get('image_bytes_saved', 0),
+        'rules': entry.get('rules', {}),
+    }
+
+@bp.route('/metrics')
+def metrics():
+    cache = result_cache.stats()
+    fragments = shared_fragment_cache_stats()
+    disk = workspaces.stats()
+    extra = {
+        'docx_result_cache_hits_total': ('counter', 'Result cache hits', cache['hits']),
+        'docx_result_cache_misses_total': ('counter', 'Result cache misses', cache['misses']),
+        'docx_result_cache_evictions_total': ('counter', 'Result cache evictions', cache['evictions']),
+        'docx_result_cache_write_errors_total': ('counter', 'Results that could not be written to the cache',
+                                                 cache['write_errors']),
+        'docx_result_cache_entries': ('gauge', 'Results currently cached', cache['entries']),
+        'docx_result_cache_bytes': ('gauge', 'Bytes of results currently cached', cache['bytes']),
+        # Uploads are formatted in this process; jobs and batches use each worker's own cache
+        'docx_fragment_cache_hits_total': ('counter', 'Fragment cache hits in this process', fragments['hits']),
+        'docx_fragment_cache_misses_total': ('counter', 'Fragment cache misses in this process', fragments['misses']),
+        'docx_fragment_cache_evictions_total': ('counter', 'Fragment cache evictions in this process',
+                                                fragments['evictions']),
+        'docx_fragment_cache_entries': ('gauge', 'Formatted blocks currently cached in this process',
+                                        fragments['entries']),
+        'docx_fragment_cache_bytes': ('gauge', 'Bytes of formatted blocks currently cached in this process',
+                                      fragments['bytes']),
+        'docx_jobs_pending': ('gauge', 'Unfinished jobs in the queue', job_queue.pending),
+        'docx_workspace_disk_bytes': ('gauge', 'Bytes on disk in request workspaces', disk['disk_bytes']),
+        'docx_workspace_reserved_bytes': ('gauge', 'Disk bytes reserved by requests in flight', disk['reserved_bytes']),
+        'docx_workspace_quota_bytes': ('gauge', 'Disk quota for request workspaces', disk['quota_bytes'] or 0),
+        'docx_workspaces_active': ('gauge', 'Request workspaces with files on disk', disk['active']),
+        'docx_workspace_rejected_total': ('counter', 'Requests refused for lack of disk quota', disk['rejected']),
+        'docx_workspace_swept_total': ('counter', 'Abandoned workspaces removed by the sweeper', disk['swept']),
+    }
+    return Response(formatter_metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
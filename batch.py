@@ -0,0 +1,286 @@
+"""
+Format a whole archive or directory of .docx files in parallel.
+
+Documents are fanned out across a process pool and handed back as each one
+finishes, together with a per-file manifest entry (status, error, timing).
+The /batch route streams the results back as a zip; the command line entry
+point writes them into a directory and can resume a partially completed run:
+
+    python batch.py papers/ formatted/ --footer-text "Proc. 2024" --resume
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def output_name(name):
+    """Return the formatted file name for input *name*"""
+    base, ext = os.path.splitext(os.path.basename(name))
+    return f"{base}_processed{ext}"
+
+
+def format_one(name, data, footer_text="", options=None, profile=False):
+    """Format one document with formatter.FormatOptions *options*; runs in a worker process"""
+    # Imported here so worker processes only load python-docx once they format something
+    from formatter import format_docx_job
+
+    start = time.perf_counter()
+    try:
+        output, stats = format_docx_job(data, footer_text, options, profile)
+        error = None
+    except Exception as e:
+        output, stats = None, None
+        error = str(e) or e.__class__.__name__
+    return name, output, error, time.perf_counter() - start, stats
+
+
+def format_batch(items, executor, footer_text="", max_in_flight=None, options=None, profile_rate=0.0):
+    """
+    Format *items* on *executor* and yield ``(name, output, entry)`` as each finishes.
+
+    *items* is an iterable of ``(name, load)`` pairs where ``load()`` returns
+    the document bytes; it is only called when the document is submitted, so
+    at most *max_in_flight* documents are held in memory at once. *output*
+    is None when formatting failed, and *entry* is the document's manifest
+    entry. A *profile_rate* fraction of documents is run under cProfile.
+    """
+    max_in_flight = max_in_flight or 2 * getattr(executor, '_max_workers', os.cpu_count() or 1)
+    pending = {}
+    items = iter(items)
+    exhausted = False
+
+    while pending or not exhausted:
+        while not exhausted and len(pending) < max_in_flight:
+            try:
+                name, load = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            try:
+                profile = random.random() < profile_rate
+                pending[executor.submit(format_one, name, load(), footer_text, options, profile)] = name
+            except Exception as e:
+                yield name, None, manifest_entry(name, None, str(e), 0.0)
+
+        if not pending:
+            continue
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                name, output, error, seconds, stats = future.result()
+            except Exception as e:
+                # The worker process itself died
+                output, error, seconds, stats = None, str(e) or e.__class__.__name__, 0.0, None
+            yield name, output, manifest_entry(name, output, error, seconds, stats)
+
+
+def manifest_entry(name, output, error, seconds, stats=None):
+    entry = {
+        'name': name,
+        'output': output_name(name) if output is not None else None,
+        'status': 'ok' if output is not None else 'error',
+        'error': error,
+        'seconds': round(seconds, 3),
+    }
+    if stats:
+        entry['stages'] = {stage: round(value, 4) for stage, value in stats['stages'].items()}
+        entry['counts'] = stats['counts']
+        if stats.get('image_bytes_saved'):
+            entry['image_bytes_saved'] = stats['image_bytes_saved']
+        if stats.get('rules'):
+            entry['rules'] = {rule: [hits, round(seconds, 6)] for rule, (hits, seconds) in stats['rules'].items()}
+    return entry
+
+
+def manifest_summary(entries):
+    """Return the manifest document for a list of per-file entries"""
+    counts = {}
+    for entry in entries:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return {
+        'total': len(entries),
+        'counts': counts,
+        'seconds': round(sum(entry['seconds'] for entry in entries), 3),
+        'files': entries,
+    }
+
+
+def valid_manifest(manifest):
+    """Return True if *manifest* has the shape manifest_summary() gives, so it can be resumed from"""
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('files', []), list):
+        return False
+    return all(isinstance(entry, dict) and isinstance(entry.get('name'), str) and 'status' in entry
+               for entry in manifest.get('files', []))
+
+
+def completed_names(manifest):
+    """Return the names a previous manifest records as successfully formatted"""
+    if not manifest:
+        return set()
+    return {entry['name'] for entry in manifest.get('files', []) if entry.get('status') == 'ok'}
+
+
+def iter_archive_documents(archive):
+    """Yield ``(name, load)`` for every .docx member of an open ZipFile"""
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith('__MACOSX/'):
+            continue
+        if not name.lower().endswith('.docx') or os.path.basename(name).startswith('~$'):
+            continue
+        yield name, (lambda info=info: archive.read(info))
+
+
+class _ZipStream:
+    """Write-only file object that hands back whatever zipfile has written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_batch_zip(archive, executor, footer_text="", previous_manifest=None, options=None,
+                     profile_rate=0.0, on_entry=None):
+    """
+    Format every .docx in *archive* and yield the output zip in chunks as documents finish.
+
+    Documents that *previous_manifest* records as done are skipped and
+    carried over, so a client can resume a batch by sending back the
+    manifest.json of an interrupted response. *on_entry* is called with
+    each new manifest entry.
+    """
+    skip = completed_names(previous_manifest)
+    carried = [entry for entry in (previous_manifest or {}).get('files', []) if entry['name'] in skip]
+    items = (item for item in iter_archive_documents(archive) if item[0] not in skip)
+
+    stream = _ZipStream()
+    # The carried documents' outputs are already with the client, so new ones must not reuse their names
+    used_names = {entry['output'] for entry in carried if entry.get('output')}
+    entries = list(carried)
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as out_zip:
+        for name, output, entry in format_batch(items, executor, footer_text, options=options,
+                                                profile_rate=profile_rate):
+            if output is not None:
+                entry['output'] = _unique_name(entry['output'], used_names)
+                out_zip.writestr(entry['output'], output)
+            if on_entry is not None:
+                on_entry(entry)
+            entries.append(entry)
+            yield stream.drain()
+        out_zip.writestr(MANIFEST_NAME, json.dumps(manifest_summary(entries), indent=2))
+    yield stream.drain()
+
+
+def _unique_name(name, used_names):
+    # Archives may hold the same file name in different folders
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used_names:
+        n += 1
+        candidate = f"{base}_{n}{ext}"
+    used_names.add(candidate)
+    return candidate
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def format_directory(input_dir, output_dir, footer_text="", workers=None, resume=False, options=None):
+    """
+    Format every .docx in *input_dir* into *output_dir* and return the manifest.
+
+    The manifest is rewritten after each document, so with *resume* an
+    interrupted run picks up where it stopped and only retries documents
+    that failed or never finished.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    previous = None
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    skip = {name for name in completed_names(previous)
+            if os.path.exists(os.path.join(output_dir, output_name(name)))}
+    entries = [entry for entry in (previous or {}).get('files', []) if entry['name'] in skip]
+
+    def load(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    names = sorted(name for name in os.listdir(input_dir)
+                   if name.lower().endswith('.docx') and not name.startswith('~$'))
+    items = [(name, lambda path=os.path.join(input_dir, name): load(path))
+             for name in names if name not in skip]
+    if skip:
+        print(f"Resuming: {len(skip)} already formatted, {len(items)} to go")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name, output, entry in format_batch(items, executor, footer_text, options=options):
+            if output is not None:
+                with open(os.path.join(output_dir, entry['output']), 'wb') as f:
+                    f.write(output)
+            entries.append(entry)
+            _write_json(manifest_path, manifest_summary(entries))
+            print(f"[{len(entries)}/{len(names)}] {name}: {entry['status']} ({entry['seconds']}s)"
+                  + (f" - {entry['error']}" if entry['error'] else ''))
+
+    manifest = manifest_summary(entries)
+    _write_json(manifest_path, manifest)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Format every .docx file in a directory in parallel")
+    parser.add_argument('input_dir', help="directory containing .docx files")
+    parser.add_argument('output_dir', help="directory for the formatted files and manifest.json")
+    parser.add_argument('--footer-text', default="", help="custom footer text for every document")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--resume', action='store_true', help="skip files a previous run already formatted")
+    parser.add_argument('--image-dpi', type=int, default=None,
+                        help="downsample pictures to this DPI at their display size (default: keep originals)")
+    parser.add_argument('--template', default=None,
+                        help="house template .docx for the output's styles and page setup")
+    parser.add_argument('--heading-rules', default=None,
+                        help="heading rules file to categorize paragraphs with (default: heading_rules.json)")
+    parser.add_argument('--preserve-formatting', action='store_true',
+                        help="keep inline bold/italic/sub/superscript/font changes in body text and references")
+    parser.add_argument('--fragment-cache-mb', type=int, default=0,
+                        help="per-worker memory for reusing blocks shared by several files, e.g. revisions (default: off)")
+    args = parser.parse_args(argv)
+
+    from formatter import FormatOptions
+    options = FormatOptions(image_dpi=args.image_dpi, template=args.template, heading_rules=args.heading_rules,
+                            fragment_cache_bytes=args.fragment_cache_mb * 1024 * 1024,
+                            preserve_formatting=args.preserve_formatting)
+    manifest = format_directory(args.input_dir, args.output_dir, args.footer_text,
+                                workers=args.workers, resume=args.resume, options=options)
+    print(f"Done: {manifest['counts']} in {manifest['seconds']}s of worker time")
+    return 0 if manifest['counts'].get('error', 0) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Benchmark scripts for the DOCX formatter. Run from the repo root, e.g. ``python -m benchmarks.image_io``."""
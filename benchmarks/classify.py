@@ -0,0 +1,88 @@
+"""
+Paragraphs per second: per-run ``.xml`` serialization vs the single-pass classifier.
+
+    python -m benchmarks.classify [paragraph_count] [runs_per_paragraph]
+"""
+import sys
+import time
+
+from docx import Document
+from docx.oxml.table import CT_Tbl
+from docx.oxml.text.paragraph import CT_P
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from classify import classify_blocks
+
+
+def create_long_document(paragraph_count=5000, runs_per_paragraph=6):
+    """Build a document whose paragraphs each contain several runs"""
+    doc = Document()
+    doc.add_paragraph("LONG PAPER TITLE")
+    for i in range(paragraph_count):
+        if i % 50 == 0:
+            doc.add_paragraph(f"{i // 50 + 1}. Section heading")
+            continue
+        p = doc.add_paragraph()
+        for j in range(runs_per_paragraph):
+            run = p.add_run(f"Run {j} of paragraph {i} with some body text. ")
+            run.bold = j % 3 == 0
+    return doc
+
+
+def iter_block_items(doc):
+    """The previous app.iter_block_items: wrap each body child in a Paragraph or Table"""
+    for child in doc.element.body.iterchildren():
+        if isinstance(child, CT_P):
+            yield Paragraph(child, doc)
+        elif isinstance(child, CT_Tbl):
+            yield Table(child, doc)
+
+
+def legacy_scan(doc):
+    """The previous process_docx detection loop, kept here as the baseline"""
+    count = 0
+    for block in iter_block_items(doc):
+        if isinstance(block, Paragraph):
+            text = block.text.strip()
+            has_images = False
+            for run in block.runs:
+                if 'graphicData' in run._element.xml or 'pic:pic' in run._element.xml:
+                    has_images = True
+                    break
+            count += 1
+    return count
+
+
+def classifier_scan(doc):
+    count = 0
+    for block in classify_blocks(doc.element.body):
+        if block.kind == 'paragraph':
+            count += 1
+    return count
+
+
+def measure(label, fn, doc, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn(doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rate = count / best
+    print(f"{label:<28} {count} paragraphs in {best:.3f}s  ({rate:,.0f} paragraphs/s)")
+    return rate
+
+
+def main():
+    paragraph_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    runs_per_paragraph = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    doc = create_long_document(paragraph_count, runs_per_paragraph)
+
+    legacy = measure("Per-run .xml loop", legacy_scan, doc)
+    single = measure("Single-pass classifier", classifier_scan, doc)
+    print(f"Speedup: {single / legacy:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
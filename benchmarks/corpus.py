@@ -0,0 +1,99 @@
+"""
+Synthetic, scalable paper corpus for benchmarking process_docx.
+
+Every document starts from verify_fix.build_test_document(), so each one
+still passes verify_fix.verify_output() after formatting. It is then grown
+to a realistic size: body paragraphs with a configurable heading mix,
+tables, figures and a reference list.
+"""
+import io
+import random
+
+from docx.shared import Inches
+
+from verify_fix import build_test_document
+
+SECTION_NAMES = ['Methodology', 'Results', 'Discussion', 'Related Work', 'Evaluation', 'Conclusion']
+WORDS = ('automation process system analysis data model result method sample control '
+         'quality production cost reduction efficiency study design measurement').split()
+
+
+def body_sentence(rng, words=18):
+    sentence = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return sentence[0].upper() + sentence[1:] + '.'
+
+
+def create_figure(rng, size):
+    """Return PNG bytes for a noisy figure of *size* pixels"""
+    from PIL import Image
+    img = Image.effect_noise(size, rng.randint(10, 80)).convert('RGB')
+    output = io.BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+def build_corpus_document(paragraphs=200, heading_ratio=0.1, uppercase_ratio=0.2,
+                          tables=2, table_rows=10, table_cols=4,
+                          images=2, image_size=(800, 600),
+                          references=30, runs_per_paragraph=3, seed=0):
+    """
+    Return a python-docx Document shaped like a real paper.
+
+    *heading_ratio* of the *paragraphs* are headings, of which
+    *uppercase_ratio* are UPPERCASE inner headings and the rest numbered
+    subheadings. *tables* tables of *table_rows* x *table_cols* and *images*
+    figures of *image_size* pixels are spread evenly through the body, and
+    the document ends with *references* reference entries.
+    """
+    rng = random.Random(seed)
+    doc = build_test_document()
+    doc.add_paragraph("Abstract: " + ' '.join(body_sentence(rng) for _ in range(4)))
+
+    table_every = paragraphs // (tables + 1) if tables else None
+    image_every = paragraphs // (images + 1) if images else None
+    figure_bytes = create_figure(rng, image_size) if images else None
+    section_number = 1
+    tables_added = images_added = 0
+
+    for i in range(1, paragraphs + 1):
+        if rng.random() < heading_ratio:
+            if rng.random() < uppercase_ratio:
+                doc.add_paragraph(rng.choice(SECTION_NAMES).upper() + " AND ANALYSIS")
+            else:
+                section_number += 1
+                doc.add_paragraph(f"{section_number}. {rng.choice(SECTION_NAMES)}")
+            continue
+
+        p = doc.add_paragraph()
+        for j in range(runs_per_paragraph):
+            run = p.add_run(body_sentence(rng) + ' ')
+            run.bold = j == 1 and rng.random() < 0.2
+            run.italic = j == 2 and rng.random() < 0.2
+
+        if table_every and i % table_every == 0 and tables_added < tables:
+            table = doc.add_table(rows=table_rows, cols=table_cols)
+            table.style = 'Table Grid'
+            for r_idx, row in enumerate(table.rows):
+                for c_idx, cell in enumerate(row.cells):
+                    cell.text = f"{r_idx}.{c_idx}"
+            tables_added += 1
+
+        if image_every and i % image_every == 0 and images_added < images:
+            figure_p = doc.add_paragraph()
+            figure_p.add_run().add_picture(io.BytesIO(figure_bytes), width=Inches(3))
+            figure_p.add_run(f"Figure {images_added + 1}. Measured results")
+            images_added += 1
+
+    if references:
+        doc.add_paragraph("REFERENCES")
+        for i in range(references):
+            doc.add_paragraph(f"Author {i + 1}, A. {body_sentence(rng, 8)} Journal of Tests, {2000 + i % 24}.")
+
+    return doc
+
+
+def create_corpus_docx(**params):
+    """Return the bytes of build_corpus_document(**params)"""
+    output = io.BytesIO()
+    build_corpus_document(**params).save(output)
+    return output.getvalue()
@@ -0,0 +1,105 @@
+"""
+Heading classification: the compiled rule engine vs the previous hard-coded heuristics.
+
+Both are run over the paragraph texts of a corpus document plus a set of
+edge cases; every category must agree. The timings are followed by the
+per-rule hit counts and matching time classify_blocks records.
+
+    python -m benchmarks.heading_rules [paragraph_count] [reference_count]
+"""
+import re
+import sys
+import time
+
+from benchmarks.corpus import build_corpus_document
+from classify import classify_blocks
+from heading_rules import load_rules
+
+SUBHEADING_PATTERN = re.compile(r'^(\d+|[A-ZIVX]+)[\.\)]\s+')
+SUBHEADING_KEYWORDS = ('INTRODUCTION', 'CONCLUSION', 'CHAPTER', 'SECTION', 'METHODOLOGY',
+                       'RESULT', 'DISCUSSION', 'ABSTRACT', 'KEYWORDS')
+
+EDGE_CASES = [
+    'REFERENCES', 'Bibliography', 'ABSTRACT', 'Abstract: text', 'KEYWORDS: a, b', 'AIM', 'IV. Results',
+    '2) Setup', 'Methods:', 'Results of the study', 'The Introduction of a new results section in a long line',
+    'ALL CAPS HEADING', 'x', '3.5 percent', 'A. Overview', 'SECTION', 'Plain body text.',
+]
+
+
+def legacy_category(text, title_found=False, in_references=False):
+    """The previous classify.heading_category, kept here as the baseline"""
+    upper = text.upper()
+    if 'REFERENCES' in upper or 'BIBLIOGRAPHY' in upper:
+        return 'references_heading'
+    is_upper = text.isupper()
+    if in_references and not is_upper:
+        return 'reference'
+    word_count = len(text.split())
+    is_uppercase_heading = is_upper and word_count > 1
+    if is_uppercase_heading and not title_found:
+        return 'title'
+    if upper.startswith('ABSTRACT') or upper.startswith('KEYWORDS'):
+        return 'special'
+    if is_uppercase_heading:
+        return 'heading'
+    if (SUBHEADING_PATTERN.match(text) or
+            (word_count <= 8 and any(word in upper for word in SUBHEADING_KEYWORDS)) or
+            text.endswith(':') or
+            is_upper):
+        return 'subheading'
+    return 'body'
+
+
+def classify_texts(texts, categorize):
+    """Run *categorize* over *texts* with the classifier's state tracking and return the categories"""
+    title_found = in_references = False
+    categories = []
+    for text in texts:
+        category = categorize(text, title_found, in_references)
+        if category == 'references_heading':
+            in_references = True
+        elif category == 'title':
+            title_found = True
+        categories.append(category)
+    return categories
+
+
+def measure(label, texts, categorize, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        categories = classify_texts(texts, categorize)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<24} {len(texts)} paragraphs in {best * 1000:.1f}ms  ({best / len(texts) * 1e6:.2f}us each)")
+    return categories
+
+
+def main():
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    references = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    doc = build_corpus_document(paragraphs=paragraphs, references=references, tables=0, images=0)
+    texts = [p.text.strip() for p in doc.paragraphs if p.text.strip()]
+    rules = load_rules()
+
+    for state in ((False, False), (True, False), (False, True), (True, True)):
+        for text in EDGE_CASES:
+            assert rules.match(text, *state).category == legacy_category(text, *state), (text, state)
+
+    legacy = measure("Hard-coded heuristics", texts, legacy_category)
+    engine = measure("Compiled rule engine", texts,
+                     lambda text, title_found, in_references: rules.match(text, title_found, in_references).category)
+    mismatches = sum(a != b for a, b in zip(legacy, engine))
+    print(f"Category mismatches: {mismatches}")
+
+    rule_stats = {}
+    for _ in classify_blocks(doc.element.body, rules, rule_stats):
+        pass
+    for rule in rules.rules + (rules.default,):
+        hits, seconds = rule_stats.get(rule.name, (0, 0.0))
+        print(f"  {rule.name:<24} {hits:>7} hits {seconds * 1000:>8.2f}ms")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Disk I/O per request for the image pipeline.
+
+Compares the old extract-to-temp-dir approach with the in-memory,
+relationship-aware pipeline now used by process_docx. Bytes written are
+read from /proc/self/io (Linux only).
+
+    python -m benchmarks.image_io [image_count]
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from docx import Document
+from docx.shared import Inches
+
+from formatter import process_docx
+
+
+def create_image_docx(image_count=20, size=(1600, 1200)):
+    """Build a .docx in memory with *image_count* distinct images"""
+    from PIL import Image
+    doc = Document()
+    doc.add_paragraph("IMAGE BENCHMARK DOCUMENT")
+    for i in range(image_count):
+        doc.add_paragraph(f"Paragraph before figure {i + 1}.")
+        img = io.BytesIO()
+        Image.new('RGB', size, (i * 12 % 256, 80, 160)).save(img, format='PNG')
+        img.seek(0)
+        doc.add_paragraph().add_run().add_picture(img, width=Inches(3))
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def bytes_written():
+    """Return the number of bytes this process has passed to write() so far"""
+    with open('/proc/self/io') as f:
+        for line in f:
+            if line.startswith('wchar:'):
+                return int(line.split()[1])
+    return 0
+
+
+def legacy_extract(docx_bytes):
+    """The previous extract_images_from_docx behaviour, kept here as the baseline"""
+    image_paths = []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as zip_ref:
+            zip_ref.extractall(temp_dir)
+        media_path = os.path.join(temp_dir, 'word', 'media')
+        if os.path.exists(media_path):
+            for filename in os.listdir(media_path):
+                temp_image_path = os.path.join(tempfile.gettempdir(), f"bench_temp_{filename}")
+                shutil.copy2(os.path.join(media_path, filename), temp_image_path)
+                image_paths.append(temp_image_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return image_paths
+
+
+def main():
+    if not os.path.exists('/proc/self/io'):
+        print("/proc/self/io is not available; this benchmark needs Linux")
+        return 1
+
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    docx_bytes = create_image_docx(image_count)
+    print(f"Input: {len(docx_bytes)} bytes, {image_count} images")
+
+    before = bytes_written()
+    leftovers = legacy_extract(docx_bytes)
+    legacy_bytes = bytes_written() - before
+    for path in leftovers:
+        os.remove(path)
+
+    output = io.BytesIO()
+    before = bytes_written()
+    ok = process_docx(io.BytesIO(docx_bytes), output)
+    pipeline_bytes = bytes_written() - before
+
+    print(f"Legacy image extraction: {legacy_bytes} bytes written to disk")
+    print(f"In-memory pipeline:      {pipeline_bytes} bytes written to disk "
+          f"(full process_docx, output {len(output.getvalue())} bytes in memory)")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Image sizing cost and output size with and without downsampling.
+
+Builds a document with large scanned-figure-sized pictures and reports the
+time to size them from headers vs opening them with PIL, and the output
+size and bytes saved per document at the target DPI.
+
+    python -m benchmarks.images [image_count] [target_dpi]
+"""
+import io
+import sys
+import time
+
+from docx import Document
+from docx.shared import Inches
+from PIL import Image
+
+from formatter import process_docx
+from images import read_image_size
+
+
+def create_scanned_figure(index, size=(6000, 4000)):
+    """A noisy, photo-like picture that compresses about as badly as a real scan"""
+    img = Image.effect_noise(size, 40 + index).convert('RGB')
+    output = io.BytesIO()
+    img.save(output, format='JPEG' if index % 2 else 'PNG')
+    return output.getvalue()
+
+
+def create_figure_docx(image_count=4):
+    doc = Document()
+    doc.add_paragraph("FIGURE HEAVY PAPER")
+    figures = []
+    for i in range(image_count):
+        figure = create_scanned_figure(i)
+        figures.append(figure)
+        doc.add_paragraph(f"Figure {i + 1} shows the scan.")
+        doc.add_paragraph().add_run().add_picture(io.BytesIO(figure), width=Inches(4))
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue(), figures
+
+
+def pil_size(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def time_sizing(fn, figures, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for figure in figures:
+            fn(figure)
+    return (time.perf_counter() - start) / (repeat * len(figures))
+
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    target_dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    docx_bytes, figures = create_figure_docx(image_count)
+
+    print(f"Header sizing: {time_sizing(read_image_size, figures) * 1e6:8.1f} us per image")
+    print(f"PIL sizing:    {time_sizing(pil_size, figures) * 1e6:8.1f} us per image")
+
+    original = process_docx(docx_bytes)
+    stats = {}
+    start = time.perf_counter()
+    optimized = process_docx(docx_bytes, image_dpi=target_dpi, stats=stats)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    process_docx(docx_bytes, image_dpi=target_dpi)
+    cached = time.perf_counter() - start
+
+    print(f"Output without downsampling: {len(original):>10} bytes")
+    print(f"Output at {target_dpi} DPI:          {len(optimized):>10} bytes "
+          f"(images {stats['image_bytes_in']} -> {stats['image_bytes_out']}, "
+          f"saved {stats['image_bytes_saved']})")
+    print(f"process_docx at {target_dpi} DPI: {first:.2f}s first run, {cached:.2f}s with cached images")
+
+
+if __name__ == '__main__':
+    main()
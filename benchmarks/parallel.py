@@ -0,0 +1,97 @@
+"""
+Speedup of process_docx_parallel over process_docx as worker processes are added.
+
+One book-length corpus document is formatted sequentially, then in
+chunks on process pools of each worker count (the pool is started, and
+its workers warmed up, before the clock starts). For each run the wall
+time, the speedup over the sequential run and the parallel efficiency
+(speedup per worker) are reported. A run whose chunks are formatted
+in-process, only when the stitcher asks for them, measures the seconds
+the calling process spends on its own (the first pass, stitching and
+saving); those bound the speedup however many cores there are, and the
+bound is printed too.
+Every parallel output must hold the same parts, byte for byte, as the
+sequential one.
+
+    python -m benchmarks.parallel [paragraph_count] [worker_count ...]
+"""
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+
+from benchmarks.corpus import create_corpus_docx
+from formatter import FormatOptions, process_docx
+from parallel import process_docx_parallel
+
+DEFAULT_PARAGRAPHS = 20000
+
+
+class DeferredExecutor:
+    """Runs each call in this process when its result is asked for, so the chunks' work shows up as 'wait'"""
+
+    _max_workers = 4
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.result = lambda timeout=None: fn(*args)
+        return future
+
+
+def package_parts(docx_bytes):
+    """Return {member name: bytes} of a DOCX, leaving out the zip's own timestamps"""
+    with zipfile.ZipFile(BytesIO(docx_bytes)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    return best
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    paragraphs = int(argv[0]) if argv else DEFAULT_PARAGRAPHS
+    counts = [int(arg) for arg in argv[1:]] or sorted({1, 2, 4, os.cpu_count() or 1})
+    data = create_corpus_docx(paragraphs=paragraphs, tables=20, table_rows=20, images=10, references=500)
+    # Both paths pick the in-memory or streaming backend by size, as format_docx_job does
+    options = FormatOptions()
+    streaming = len(data) >= options.streaming_min_size
+
+    sequential, expected = best_of(lambda: process_docx(data, footer_text="Benchmark", streaming=streaming), 2)
+    expected = package_parts(expected)
+    stats = {}
+    total, _ = best_of(lambda: process_docx_parallel(
+        data, footer_text="Benchmark", options=options, executor=DeferredExecutor(), stats=stats), 2)
+    serial = total - stats['stages']['wait']
+    print(f"{paragraphs} paragraphs, {len(data) // 1024} KB, {os.cpu_count()} CPUs, "
+          f"{'streaming' if streaming else 'in-memory'} backend")
+    print(f"Sequential {sequential:.2f} s; chunked in-process {total:.2f} s, of which {serial:.2f} s "
+          f"in the calling process, so at most {sequential / serial:.2f}x faster")
+    print(f"{'workers':>7} {'chunks':>6} {'seconds':>8} {'speedup':>8} {'efficiency':>10} {'identical':>9}")
+
+    identical = True
+    for workers in counts:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Start every worker and load its imports before timing
+            list(executor.map(abs, range(workers * 4)))
+            stats = {}
+            seconds, output = best_of(lambda: process_docx_parallel(
+                data, footer_text="Benchmark", options=options, executor=executor, stats=stats), 2)
+        same = package_parts(output) == expected
+        identical = identical and same
+        print(f"{workers:>7} {stats['counts']['chunks']:>6} {seconds:>8.2f} {sequential / seconds:>8.2f} "
+              f"{sequential / seconds / workers:>10.2f} {str(same):>9}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
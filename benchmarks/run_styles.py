@@ -0,0 +1,154 @@
+"""
+Run formatting preservation: interned character styles vs direct formatting on every run.
+
+The corpus is rewritten the way Word saves manuscripts: body paragraphs
+and references are split into many runs (revision marks break runs even
+where nothing changes), every run carries the font and size as direct
+formatting, and some hold italics, bold or superscript citations. Each
+document is formatted three ways:
+
+    plain      the default, which drops run formatting
+    direct     every run keeps its own w:rPr, runs are not merged (the baseline)
+    interned   preserve_formatting: one character style per distinct set, neighbours merged
+
+and the sizes of word/document.xml and the output file are reported with
+the time to format, open and save the output. The direct and interned
+outputs must carry the same formatting on every character.
+
+    python -m benchmarks.run_styles [paragraph_count] [reference_count]
+"""
+import io
+import random
+import sys
+import time
+import zipfile
+from copy import deepcopy
+from unittest import mock
+
+from docx import Document
+from docx.shared import Pt
+from lxml import etree
+
+import formatter
+from benchmarks.corpus import build_corpus_document
+from classify import W_R, run_text
+from run_styles import PRESERVED_PROPERTIES, W_RPR, append_text, run_properties_key
+
+RUN_PIECES = 6
+
+
+def wordify(doc, seed=0):
+    """Split *doc*'s text paragraphs into Word-like runs with direct formatting, in place"""
+    rng = random.Random(seed)
+    for p in doc.paragraphs:
+        text = p.text
+        if not text.strip():
+            continue
+        words = text.split(' ')
+        cuts = sorted(rng.sample(range(1, len(words)), min(RUN_PIECES - 1, len(words) - 1))) if len(words) > 1 else []
+        for r in list(p._p.iterchildren(W_R)):
+            p._p.remove(r)
+        start = 0
+        for end in cuts + [len(words)]:
+            run = p.add_run(' '.join(words[start:end]) + (' ' if end < len(words) else ''))
+            run.font.name = 'Times New Roman'
+            run.font.size = Pt(12)
+            roll = rng.random()
+            if roll < 0.15:
+                run.italic = True
+            elif roll < 0.2:
+                run.bold = True
+            start = end
+        if rng.random() < 0.5:
+            citation = p.add_run(f"{rng.randint(1, 60)}")
+            citation.font.name = 'Times New Roman'
+            citation.font.size = Pt(12)
+            citation.font.superscript = True
+    return doc
+
+
+def append_direct_runs(p, src_p, run_styles):
+    """The baseline: one output run per source run, each with its own copy of the preserved properties"""
+    runs = [(r.find(W_RPR), run_text(r)) for r in src_p.iterchildren(W_R)]
+    runs = [(rPr, text) for rPr, text in runs if text]
+    while runs and not runs[0][1].strip():
+        runs.pop(0)
+    while runs and not runs[-1][1].strip():
+        runs.pop()
+    if not runs:
+        return
+    runs[0] = (runs[0][0], runs[0][1].lstrip())
+    runs[-1] = (runs[-1][0], runs[-1][1].rstrip())
+    for rPr, text in runs:
+        r = etree.SubElement(p, W_R)
+        if run_properties_key(rPr) is not None:
+            new_rPr = etree.SubElement(r, W_RPR)
+            for child in rPr:
+                if child.tag in PRESERVED_PROPERTIES:
+                    new_rPr.append(deepcopy(child))
+        append_text(r, text)
+
+
+def formatting_spans(docx_bytes):
+    """Return [(preserved properties, text), ...] per paragraph, with styles resolved and neighbours joined"""
+    doc = Document(io.BytesIO(docx_bytes))
+    styles = doc.styles.element
+    paragraphs = []
+    for p in doc.paragraphs:
+        spans = []
+        for r in p._p.iterchildren(W_R):
+            rPr = r.rPr
+            if rPr is not None and rPr.style is not None:
+                rPr = styles.get_by_id(rPr.style).rPr
+            key = run_properties_key(rPr)
+            text = run_text(r)
+            if spans and spans[-1][0] == key:
+                spans[-1] = (key, spans[-1][1] + text)
+            else:
+                spans.append((key, text))
+        paragraphs.append(spans)
+    return paragraphs
+
+
+def measure(label, data, repeat=3, **kwargs):
+    best = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = formatter.process_docx(data, **kwargs)
+        timings = {'format': time.perf_counter() - start}
+        start = time.perf_counter()
+        doc = Document(io.BytesIO(output))
+        timings['open'] = time.perf_counter() - start
+        start = time.perf_counter()
+        doc.save(io.BytesIO())
+        timings['save'] = time.perf_counter() - start
+        best = {name: min(seconds, best.get(name, seconds)) for name, seconds in timings.items()}
+    document_xml = len(zipfile.ZipFile(io.BytesIO(output)).read('word/document.xml'))
+    print(f"{label:<9} {document_xml / 1024:>10.1f} {len(output) / 1024:>10.1f} "
+          f"{best['format']:>8.3f} {best['open']:>8.3f} {best['save']:>8.3f}")
+    return output
+
+
+def main():
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    references = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    doc = wordify(build_corpus_document(paragraphs=paragraphs, references=references, tables=0, images=0))
+    source = io.BytesIO()
+    doc.save(source)
+    data = source.getvalue()
+
+    print(f"{'mode':<9} {'doc.xml KB':>10} {'output KB':>10} {'format s':>8} {'open s':>8} {'save s':>8}")
+    plain = measure('plain', data)
+    with mock.patch.object(formatter, 'append_styled_runs', append_direct_runs):
+        direct = measure('direct', data, preserve_formatting=True)
+    interned = measure('interned', data, preserve_formatting=True)
+
+    texts = [''.join(text for _, text in spans) for spans in formatting_spans(plain)]
+    same_text = texts == [''.join(text for _, text in spans) for spans in formatting_spans(interned)]
+    same_formatting = formatting_spans(direct) == formatting_spans(interned)
+    print(f"Text unchanged: {same_text}  Formatting equal to direct: {same_formatting}")
+    return 0 if same_text and same_formatting else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""
+Peak memory and time of the in-memory and streaming process_docx backends as documents grow.
+
+Each run formats one corpus document in a fresh process and reports its
+peak RSS, so the streaming backend should stay roughly flat while the
+in-memory one grows with the paragraph count.
+
+    python -m benchmarks.streaming [paragraph_count ...]
+"""
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.corpus import create_corpus_docx
+from benchmarks.suite import peak_rss_mb
+
+DEFAULT_SIZES = (1000, 5000, 20000)
+
+
+def run_backend(docx_bytes, streaming):
+    """Format *docx_bytes* in this (fresh) process and return (seconds, peak RSS MB, output bytes)"""
+    from formatter import process_docx
+
+    start = time.perf_counter()
+    output = process_docx(docx_bytes, streaming=streaming)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss_mb(), len(output) if output is not None else 0
+
+
+def measure(docx_bytes, streaming):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_backend, docx_bytes, streaming).result()
+
+
+def main(argv=None):
+    sizes = [int(arg) for arg in (argv if argv is not None else sys.argv[1:])] or DEFAULT_SIZES
+    print(f"{'paragraphs':>10} {'input KB':>9} {'backend':>10} {'seconds':>8} {'peak RSS MB':>12} {'output KB':>10}")
+    for paragraphs in sizes:
+        docx_bytes = create_corpus_docx(paragraphs=paragraphs, tables=3, images=2, references=100)
+        for label, streaming in (('in-memory', False), ('streaming', True)):
+            seconds, rss, output_bytes = measure(docx_bytes, streaming)
+            print(f"{paragraphs:>10} {len(docx_bytes) // 1024:>9} {label:>10} {seconds:>8.2f} "
+                  f"{rss:>12.1f} {output_bytes // 1024:>10}")
+
+
+if __name__ == '__main__':
+    main()
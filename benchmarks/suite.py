@@ -0,0 +1,143 @@
+"""
+Benchmark suite for process_docx over the synthetic corpus.
+
+Each scenario is formatted in a fresh process, recording best-of-N wall
+time, peak RSS and output size, and the output is checked with
+verify_fix.verify_output so a fast-but-wrong change cannot pass. Results
+are compared with a JSON baseline; the run fails if any metric regresses
+by more than the threshold.
+
+    python -m benchmarks.suite                      # compare with the baseline
+    python -m benchmarks.suite --update-baseline    # record a new baseline
+    python -m benchmarks.suite --scenario small --threshold 0.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.corpus import create_corpus_docx
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+METRICS = ('seconds', 'peak_rss_mb', 'output_bytes')
+
+SCENARIOS = {
+    'small': dict(paragraphs=50, tables=1, images=1, references=10),
+    'medium': dict(paragraphs=400, tables=3, images=3, references=40),
+    'long': dict(paragraphs=2000, tables=5, images=4, references=150),
+    'tables': dict(paragraphs=200, tables=10, table_rows=100, table_cols=8, images=0, references=20),
+    'figures': dict(paragraphs=200, tables=1, images=8, image_size=(3000, 2000), references=20),
+    'references': dict(paragraphs=100, tables=0, images=0, references=1000),
+    'headings': dict(paragraphs=1000, heading_ratio=0.4, uppercase_ratio=0.5, tables=0, images=0),
+}
+
+
+def peak_rss_mb():
+    # VmHWM belongs to this process's own address space; ru_maxrss on Linux
+    # also carries over the peak of the parent the process was started from
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(docx_bytes, repeat):
+    """Format *docx_bytes* *repeat* times in this (fresh) process and return its measurements"""
+    from formatter import process_docx
+    from verify_fix import verify_output
+
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = process_docx(docx_bytes)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        verified = output is not None and verify_output(io.BytesIO(output))
+
+    return {
+        'seconds': round(best, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'output_bytes': len(output) if output is not None else 0,
+        'verified': verified,
+    }
+
+
+def measure(name, params, repeat):
+    docx_bytes = create_corpus_docx(**params)
+    # spawn, not fork, so the peak RSS is not inflated by this process
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        result = executor.submit(run_scenario, docx_bytes, repeat).result()
+    result['input_bytes'] = len(docx_bytes)
+    return result
+
+
+def compare(name, result, baseline, threshold):
+    """Return a list of regression messages for *result* against its *baseline* entry"""
+    regressions = []
+    for metric in METRICS:
+        old = baseline.get(metric)
+        new = result[metric]
+        if old and new > old * (1 + threshold):
+            regressions.append(f"{name}: {metric} {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_docx against a JSON baseline")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="run only this scenario (repeatable)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario; the best time is kept")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed regression per metric as a fraction (default 0.25 = 25%%)")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    failures = []
+    print(f"{'Scenario':<12} {'seconds':>9} {'peak RSS MB':>12} {'output bytes':>13}  verified")
+    for name in args.scenario or list(SCENARIOS):
+        result = measure(name, SCENARIOS[name], args.repeat)
+        results[name] = result
+        print(f"{name:<12} {result['seconds']:>9.3f} {result['peak_rss_mb']:>12.1f} "
+              f"{result['output_bytes']:>13}  {result['verified']}")
+        if not result['verified']:
+            failures.append(f"{name}: output failed verify_output")
+        if name in baseline:
+            regressions.extend(compare(name, result, baseline[name], args.threshold))
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+    elif not baseline:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+
+    for message in failures + regressions:
+        print(f"FAIL {message}")
+    return 1 if failures or (regressions and not args.update_baseline) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Table copy time: cell-by-cell python-docx copying vs XML subtree cloning.
+
+Cell copying grows quadratically with the row count (a 200x10 table takes
+well over a minute), so the default shapes are kept small. Pass a shape to
+measure it instead:
+
+    python -m benchmarks.tables [rows cols]
+"""
+import sys
+import time
+
+from docx import Document
+
+from formatter import copy_table, copy_table_cells
+
+SHAPES = [
+    ('tall 100x10', 100, 10),
+    ('wide 10x40', 10, 40),
+]
+
+
+def create_table_document(rows, cols):
+    doc = Document()
+    table = doc.add_table(rows=rows, cols=cols)
+    table.style = 'Table Grid'
+    for r_idx, row in enumerate(table.rows):
+        for c_idx, cell in enumerate(row.cells):
+            cell.text = f"r{r_idx}c{c_idx}"
+            if r_idx == 0:
+                cell.paragraphs[0].runs[0].bold = True
+    return doc
+
+
+def measure(fn, src_table, repeat=3):
+    best = None
+    for _ in range(repeat):
+        dest_doc = Document()
+        start = time.perf_counter()
+        fn(src_table, dest_doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    shapes = SHAPES
+    if len(sys.argv) > 2:
+        rows, cols = int(sys.argv[1]), int(sys.argv[2])
+        shapes = [(f"{rows}x{cols}", rows, cols)]
+
+    print(f"{'Table':<14} {'cell copy':>10} {'clone':>10} {'speedup':>8}")
+    for label, rows, cols in shapes:
+        src_table = create_table_document(rows, cols).tables[0]
+        cells = measure(copy_table_cells, src_table, repeat=1)
+        clone = measure(copy_table, src_table)
+        print(f"{label:<14} {cells:>9.3f}s {clone:>9.4f}s {cells / clone:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
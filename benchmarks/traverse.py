@@ -0,0 +1,133 @@
+"""
+Block traversal on deeply nested documents: traverse.walk() vs recursion through python-docx.
+
+Each document holds one large table whose cells nest smaller tables a
+few levels deep. Every cell also holds a paragraph with a text box,
+and the body holds content controls. The baseline visits the same
+content the way the formatter could have before walk() existed: recurse
+through python-docx's Table, row.cells and cell.tables, which cannot
+see inside content controls or text boxes at all. Reported per document
+are the paragraphs each approach reaches and its best time. As the
+table grows, the baseline's time per row should grow with the row count
+while walk()'s stays flat.
+
+    python -m benchmarks.traverse [rows ...] [--depth N]
+"""
+import argparse
+import sys
+import time
+
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.table import Table
+
+from traverse import walk
+
+DEFAULT_ROWS = (50, 100, 200, 400)
+COLUMNS = 4
+NESTED_SIZE = 2  # rows and columns of each nested table
+MC = ('xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+      'xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape" '
+      'xmlns:v="urn:schemas-microsoft-com:vml"')
+
+
+def paragraph(text):
+    return f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def text_box_paragraph(text):
+    """A paragraph anchoring a text box, as Word saves it: DrawingML with a VML fallback"""
+    box = f'<w:txbxContent>{paragraph(text + " (text box)")}</w:txbxContent>'
+    return (f'<w:p><w:r><w:t>{text}</w:t></w:r><w:r><mc:AlternateContent><mc:Choice Requires="wps"><w:drawing>'
+            f'<wp:anchor><wp:docPr id="1" name="Text Box 1"/><a:graphic><a:graphicData '
+            f'uri="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"><wps:wsp><wps:txbx>{box}'
+            f'</wps:txbx></wps:wsp></a:graphicData></a:graphic></wp:anchor></w:drawing></mc:Choice><mc:Fallback>'
+            f'<w:pict><v:shape><v:textbox>{box}</v:textbox></v:shape></w:pict></mc:Fallback></mc:AlternateContent>'
+            f'</w:r></w:p>')
+
+
+def table(rows, columns, depth, label):
+    """A table of *rows* x *columns* whose cells nest tables *depth* - 1 levels further down"""
+    parts = ['<w:tbl><w:tblPr/><w:tblGrid>', '<w:gridCol w:w="1000"/>' * columns, '</w:tblGrid>']
+    for r in range(rows):
+        parts.append('<w:tr>')
+        for c in range(columns):
+            cell_label = f'{label}.{r}.{c}'
+            parts.append(f'<w:tc>{text_box_paragraph(cell_label)}')
+            if depth > 1:
+                parts.append(table(NESTED_SIZE, NESTED_SIZE, depth - 1, cell_label))
+                parts.append('<w:p/>')  # A cell must end with a paragraph
+            parts.append('</w:tc>')
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+
+def build_document(rows, depth):
+    doc = Document()
+    sectPr = doc.element.body.sectPr
+    content_control = (f'<w:sdt {nsdecls("w")}><w:sdtPr/><w:sdtContent>{paragraph("In a content control")}'
+                       f'</w:sdtContent></w:sdt>')
+    sectPr.addprevious(parse_xml(content_control))
+    sectPr.addprevious(parse_xml(f'<w:tbl {nsdecls("w", "wp", "a")} {MC}>'
+                                 + table(rows, COLUMNS, depth, 'T')[len('<w:tbl>'):]))
+    return doc
+
+
+def python_docx_paragraphs(doc):
+    """The baseline: recurse through python-docx's wrappers, counting the paragraphs reached"""
+    def visit_cells(tbl):
+        count = 0
+        for row in tbl.rows:
+            for cell in row.cells:
+                count += len(cell.paragraphs)
+                for nested in cell.tables:
+                    count += visit_cells(nested)
+        return count
+
+    count = 0
+    for child in doc.element.body.iterchildren():
+        if child.tag.endswith('}p'):
+            count += 1
+        elif child.tag.endswith('}tbl'):
+            count += visit_cells(Table(child, doc._body))
+    return count
+
+
+def walk_paragraphs(doc):
+    return sum(1 for item in walk(doc.element.body) if item.kind == 'paragraph')
+
+
+def best_of(fn, doc, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rows', nargs='*', type=int, default=DEFAULT_ROWS)
+    parser.add_argument('--depth', type=int, default=3, help='table nesting levels, the outer table included')
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>5} {'depth':>5} {'python-docx paras':>17} {'s':>8} {'ms/row':>7} "
+          f"{'walk paras':>10} {'s':>8} {'ms/row':>7} {'speedup':>8}")
+    complete = True
+    for rows in args.rows:
+        doc = build_document(rows, args.depth)
+        baseline, baseline_count = best_of(python_docx_paragraphs, doc)
+        walked, walk_count = best_of(walk_paragraphs, doc)
+        # walk() reaches every paragraph the baseline does, plus those in content controls and text boxes
+        complete = complete and walk_count > baseline_count
+        print(f"{rows:>5} {args.depth:>5} {baseline_count:>17} {baseline:>8.3f} {baseline * 1000 / rows:>7.2f} "
+              f"{walk_count:>10} {walked:>8.3f} {walked * 1000 / rows:>7.2f} {baseline / walked:>8.1f}")
+    return 0 if complete else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
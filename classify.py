@@ -0,0 +1,155 @@
+"""
+Single-pass block classification for process_docx.
+
+Walks the body element once with precompiled tag checks and XPath
+expressions and produces one compact Block record per paragraph or table,
+so the formatter never has to serialize run XML or re-derive heading
+categories from the text. Text paragraphs are categorized by the heading
+rules in heading_rules.py. The paragraphs and tables inside content
+controls and text boxes are found by traverse.block_items() and
+classified like any other block, in document order.
+"""
+import time
+from collections import namedtuple
+
+from docx.oxml.ns import nsmap, qn
+from lxml import etree
+
+from heading_rules import load_rules
+from traverse import W_SDT, W_TXBX_CONTENT, block_items
+
+# kind: 'paragraph' or 'table'
+# category: 'table', 'image', 'empty', 'references_heading', 'reference',
+#           'title', 'heading', 'special', 'subheading' or 'body'
+# rule: name of the heading rule that decided a text paragraph's category, else None
+# container: 'body', or 'sdt' or 'textbox' for a block inside a content control or text box
+# depth: how many content controls and text boxes enclose the block
+Block = namedtuple('Block', ['kind', 'text', 'has_drawing', 'r_ids', 'category', 'element', 'rule',
+                             'container', 'depth'], defaults=['body', 0])
+
+W_P = qn('w:p')
+W_TBL = qn('w:tbl')
+W_R = qn('w:r')
+W_T = qn('w:t')
+W_TAB = qn('w:tab')
+W_BR = qn('w:br')
+W_CR = qn('w:cr')
+
+_has_drawing = etree.XPath('boolean(./w:r//a:graphicData | ./w:r//pic:pic)', namespaces=nsmap)
+_embedded_rids = etree.XPath('./w:r//a:blip/@r:embed', namespaces=nsmap)
+_drawings = etree.XPath('./w:r//a:graphicData | ./w:r//pic:pic', namespaces=nsmap)
+_blips = etree.XPath('./w:r//a:blip', namespaces=nsmap)
+R_EMBED = qn('r:embed')
+
+
+def _append_run_text(r, parts):
+    for child in r.iterchildren(W_T, W_TAB, W_BR, W_CR):
+        tag = child.tag
+        if tag == W_T:
+            if child.text:
+                parts.append(child.text)
+        elif tag == W_TAB:
+            parts.append('\t')
+        else:
+            parts.append('\n')
+
+
+def run_text(r):
+    """Return the text of a w:r element, matching python-docx's Run.text"""
+    parts = []
+    _append_run_text(r, parts)
+    return ''.join(parts)
+
+
+def _outside_text_boxes(p, elements):
+    """Return those of *elements*, all inside the w:p element *p*, that are not in one of its text boxes"""
+    own = []
+    for el in elements:
+        parent = el.getparent()
+        while parent is not p and parent.tag != W_TXBX_CONTENT:
+            parent = parent.getparent()
+        if parent is p:
+            own.append(el)
+    return own
+
+
+def paragraph_drawings(p):
+    """
+    Return (has_drawing, r_ids) for the w:p element *p*: whether it shows a picture, chart or
+    other graphic, and the relationship IDs of its pictures. Text boxes anchored in *p* are
+    neither, since their content is classified as blocks of its own.
+    """
+    if not _has_drawing(p):
+        return False, ()
+    if next(p.iter(W_TXBX_CONTENT), None) is None:
+        return True, tuple(_embedded_rids(p))
+    drawings = [el for el in _outside_text_boxes(p, _drawings(p)) if next(el.iter(W_TXBX_CONTENT), None) is None]
+    if not drawings:
+        return False, ()
+    return True, tuple(el.get(R_EMBED) for el in _outside_text_boxes(p, _blips(p)))
+
+
+def paragraph_text(p):
+    """Return the text of a w:p element, matching python-docx's Paragraph.text"""
+    parts = []
+    for r in p.iterchildren(W_R):
+        _append_run_text(r, parts)
+    return ''.join(parts)
+
+
+def classify_blocks(body, rules=None, rule_stats=None, known=None, title_found=False, in_references=False):
+    """
+    Walk *body* once and yield a Block for each paragraph and table, in document order.
+    *body* is the w:body element or an iterable of its w:p, w:tbl and w:sdt children. A
+    paragraph is followed by the blocks in its text boxes, and a content control stands for
+    the blocks inside it; tables are not entered. *rules* is a heading_rules.RuleSet (the
+    default rules when None). If *rule_stats* is a dict, the hits and seconds spent matching
+    are accumulated in it per rule name as [hits, seconds].
+
+    *known*, if given, is called as ``known(element, title_found, in_references)`` first;
+    when it returns a category the block is not classified again and is yielded with that
+    category and no text, drawing or rule. *title_found* and *in_references* are the
+    classifier state to start from, for a walk that starts partway through a document.
+    """
+    rules = rules or load_rules()
+
+    children = body.iterchildren(W_P, W_TBL, W_SDT) if hasattr(body, 'iterchildren') else body
+    items = (item for child in children for item in block_items(child))
+    for kind, child, depth, container, _ in items:
+        category = known(child, title_found, in_references) if known is not None else None
+        if category is not None:
+            if category == 'references_heading':
+                in_references = True
+            elif category == 'title':
+                title_found = True
+            yield Block(kind, '', False, (), category, child, None, container, depth)
+            continue
+
+        if kind == 'table':
+            yield Block('table', '', False, (), 'table', child, None, container, depth)
+            continue
+
+        text = paragraph_text(child).strip()
+        has_drawing, r_ids = paragraph_drawings(child)
+
+        rule = None
+        if has_drawing:
+            category = 'image'
+        elif not text:
+            category = 'empty'
+        else:
+            if rule_stats is None:
+                rule = rules.match(text, title_found, in_references)
+            else:
+                start = time.perf_counter()
+                rule = rules.match(text, title_found, in_references)
+                hits = rule_stats.setdefault(rule.name, [0, 0.0])
+                hits[0] += 1
+                hits[1] += time.perf_counter() - start
+            category = rule.category
+            if category == 'references_heading':
+                in_references = True
+            elif category == 'title':
+                title_found = True
+
+        yield Block('paragraph', text, has_drawing, r_ids, category, child, rule and rule.name, container, depth)
@@ -0,0 +1,109 @@
+"""
+Output templates, parsed once per process.
+
+Building every output with Document() re-opened and re-parsed
+python-docx's bundled default.docx on each call, including its 350KB
+styles part. load_template() parses a template (that default, or a house
+template .docx) once, and new_document() clones it: small XML parts are
+deep-copied, binary parts share their bytes, and the styles part is only
+copied if the new document actually reads or changes its styles.
+"""
+import os
+import threading
+from copy import deepcopy
+
+from docx import Document
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.part import XmlPart
+from docx.oxml.ns import qn
+from docx.package import Package
+from docx.parts.styles import StylesPart
+
+W_SECTPR = qn('w:sectPr')
+
+_templates = {}  # template_key(path) -> (Document, serialized styles part)
+_style_ids = {}  # (template_key(path), name, style type) -> style ID or None
+_templates_lock = threading.Lock()
+
+
+def template_key(path=None):
+    """Identify the template at *path*, including its modification time so edits are picked up"""
+    if path is None:
+        return ''
+    return f"{os.path.abspath(path)}@{os.stat(path).st_mtime_ns}"
+
+
+def load_template(path=None):
+    """Return the parsed template at *path*, or python-docx's default template when None"""
+    key = template_key(path)
+    with _templates_lock:
+        if key not in _templates:
+            template = Document(path)
+            # Only the section settings of a house template's body are kept
+            body = template.element.body
+            for child in list(body):
+                if child.tag != W_SECTPR:
+                    body.remove(child)
+            styles_part = template.part._styles_part
+            _templates[key] = (template, serialize_part_xml(styles_part.element))
+        return _templates[key]
+
+
+def new_document(path=None):
+    """Return a new, empty python-docx Document cloned from the template at *path*"""
+    template, styles_blob = load_template(path)
+    package = Package()
+    parts = {}
+    with _templates_lock:
+        for part in template.part.package.iter_parts():
+            if isinstance(part, StylesPart):
+                clone = _TemplateStylesPart(part, styles_blob, package)
+            elif isinstance(part, XmlPart):
+                clone = type(part)(part.partname, part.content_type, deepcopy(part.element), package)
+            else:
+                clone = type(part).load(part.partname, part.content_type, part.blob, package)
+            parts[part.partname] = (part, clone)
+
+    for part, clone in parts.values():
+        for rel in part.rels.values():
+            target = rel.target_ref if rel.is_external else parts[rel.target_part.partname][1]
+            clone.load_rel(rel.reltype, target, rel.rId, rel.is_external)
+    for rel in template.part.package.rels.values():
+        target = rel.target_ref if rel.is_external else parts[rel.target_part.partname][1]
+        package.load_rel(rel.reltype, target, rel.rId, rel.is_external)
+
+    package.after_unmarshal()
+    return package.main_document_part.document
+
+
+def template_style_id(name, style_type, path=None):
+    """Return the ID of the template's style called *name* of *style_type*, or None if it has none"""
+    key = (template_key(path), name, style_type)
+    if key not in _style_ids:
+        template, _ = load_template(path)
+        with _templates_lock:
+            style = template.styles.element.get_by_name(name)
+            _style_ids[key] = style.styleId if style is not None and style.type == style_type else None
+    return _style_ids[key]
+
+
+class _TemplateStylesPart(StylesPart):
+    """A clone's styles part, shared with the template until the clone touches its styles"""
+
+    def __init__(self, template_part, template_blob, package):
+        super().__init__(template_part.partname, template_part.content_type, None, package)
+        self._template_part = template_part
+        self._template_blob = template_blob
+
+    @property
+    def element(self):
+        if self._element is None:
+            with _templates_lock:
+                self._element = deepcopy(self._template_part.element)
+        return self._element
+
+    @property
+    def blob(self):
+        if self._element is None:
+            return self._template_blob
+        return super().blob
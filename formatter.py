@@ -0,0 +1,730 @@
+"""
+The DOCX formatter itself.
+
+process_docx() rearranges a manuscript into the conference layout, and
+format_docx_job() wraps it for the web app's jobs and the batch workers.
+Nothing here imports Flask, so worker processes and scripts only load
+python-docx.
+"""
+import functools
+import io
+import time
+from collections import namedtuple
+from copy import deepcopy
+
+from docx import Document
+from docx.enum.section import WD_SECTION
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import OxmlElement
+from docx.oxml.ns import nsmap, qn
+from docx.shared import Inches
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from classify import W_R, classify_blocks
+from document_template import new_document, template_key, template_style_id
+from fragment_cache import FragmentSession, shared_fragment_cache
+from heading_rules import load_rules, rules_key
+from images import optimize_image, read_image_size
+from metrics import StageTimer, profile_call
+from run_styles import RunStyles, append_styled_runs
+from streaming import SourceDocument, StreamingWriter
+from traverse import walk
+
+# Part of every result cache key; bump it whenever process_docx output changes
+FORMATTER_VERSION = '5'
+
+# Inputs at least this large use the streaming backend by default
+STREAMING_MIN_SIZE = 2 * 1024 * 1024
+
+# Settings for format_docx_job that stay the same across documents
+# parallel_min_size: inputs at least this large are formatted on the caller's process pool (0 never)
+FormatOptions = namedtuple('FormatOptions', ['image_dpi', 'template', 'streaming_min_size', 'heading_rules',
+                                             'fragment_cache_bytes', 'preserve_formatting', 'parallel_min_size'],
+                           defaults=[None, None, STREAMING_MIN_SIZE, None, 0, False, 0])
+
+# Column count each paragraph category needs; categories not listed follow the current section
+SECTION_COLUMNS = {'title': 1, 'heading': 2, 'special': 2, 'subheading': 2, 'body': 2}
+
+# Section layout shared by every section: 1" top/bottom and 0.75" side margins
+SECTION_MARGINS = {
+    'w:top': '1440', 'w:right': '1080', 'w:bottom': '1440', 'w:left': '1080',
+    'w:header': '720', 'w:footer': '720', 'w:gutter': '0',
+}
+# Elements that must follow w:cols inside w:sectPr
+COLS_SUCCESSORS = (
+    'w:formProt', 'w:vAlign', 'w:noEndnote', 'w:titlePg', 'w:textDirection', 'w:bidi',
+    'w:rtlGutter', 'w:docGrid', 'w:printerSettings', 'w:sectPrChange',
+)
+
+def section_change(category, current_columns):
+    """Return the column count of the new section a block of *category* starts, or None if it starts none"""
+    # Title spans 1 column; headings, Abstract/Keywords, subheadings and body text use 2
+    columns = SECTION_COLUMNS.get(category)
+    return columns if columns is not None and columns != current_columns else None
+
+@functools.lru_cache(maxsize=64)
+def build_footer_template(footer_text=""):
+    """Build the footer paragraph (page number field plus optional right-aligned text) once per footer text"""
+    footer_p = OxmlElement('w:p')
+    footer_para = Paragraph(footer_p, None)
+    pPr = footer_p.get_or_add_pPr()
+    pStyle = OxmlElement('w:pStyle')
+    pStyle.set(qn('w:val'), 'Footer')
+    pPr.append(pStyle)
+
+    if footer_text.strip():
+        # Add tab stops - one for right alignment
+        tabs = OxmlElement('w:tabs')
+        tab = OxmlElement('w:tab')
+        tab.set(qn('w:val'), 'right')
+        tab.set(qn('w:pos'), '9360')  # 6.5 inches in twentieths of a point
+        tabs.append(tab)
+        pPr.append(tabs)
+
+    # Add page number on the left
+    page_run = footer_para.add_run("Page ")
+    page_run.font.size = Inches(0.14)
+
+    # Add page number field
+    fldChar1 = OxmlElement('w:fldChar')
+    fldChar1.set(qn('w:fldCharType'), 'begin')
+
+    instrText = OxmlElement('w:instrText')
+    instrText.text = "PAGE"
+
+    fldChar2 = OxmlElement('w:fldChar')
+    fldChar2.set(qn('w:fldCharType'), 'end')
+
+    page_run._element.append(fldChar1)
+    page_run._element.append(instrText)
+    page_run._element.append(fldChar2)
+
+    if footer_text.strip():
+        # Add tab character to move to right side
+        footer_para.add_run("\t")
+
+        # Add custom footer text on the right
+        footer_run = footer_para.add_run(footer_text)
+        footer_run.font.size = Inches(0.14)
+
+    return footer_p
+
+@functools.lru_cache(maxsize=None)
+def build_section_template(columns=1):
+    """Build the w:pgMar and w:cols elements for a *columns*-column section once per process"""
+    pgMar = OxmlElement('w:pgMar', attrs={qn(name): value for name, value in SECTION_MARGINS.items()})
+    cols = OxmlElement('w:cols')
+    cols.set(qn('w:num'), str(columns))
+    cols.set(qn('w:space'), '720')  # 0.5 inch space between columns
+    return pgMar, cols
+
+def add_page_numbers_and_footer(section, footer_text=""):
+    """Add page numbers and custom footer text to the document"""
+    try:
+        footer_p = section.footer.paragraphs[0]._p
+        footer_p.getparent().replace(footer_p, deepcopy(build_footer_template(footer_text)))
+    except Exception as e:
+        print(f"Error adding page numbers and footer: {e}")
+        pass
+
+def configure_section(section, columns=1, footer_text=None):
+    """
+    Configure margins, columns, and footer for a section.
+    With *footer_text* None the section keeps the footer of the previous
+    section instead of getting a footer of its own.
+    """
+    pgMar, cols = build_section_template(columns)
+    sectPr = section._sectPr
+    # Replace existing margins and columns with copies of the template
+    for old in sectPr.xpath('./w:pgMar | ./w:cols'):
+        sectPr.remove(old)
+    sectPr._insert_pgMar(deepcopy(pgMar))
+    sectPr.insert_element_before(deepcopy(cols), *COLS_SUCCESSORS)
+
+    if footer_text is not None:
+        add_page_numbers_and_footer(section, footer_text)
+    else:
+        section.footer.is_linked_to_previous = True
+
+def start_section(doc, columns):
+    """Start a new continuous section with *columns* columns, linked to the previous footer"""
+    section = doc.add_section(WD_SECTION.CONTINUOUS)
+    configure_section(section, columns=columns)
+    return section
+
+def get_optimal_image_size(image, max_width_inches=4.5):
+    """
+    Calculate optimal image size based on aspect ratio and available space.
+    *image* may be the image bytes, a binary file-like object or a path;
+    the pixel size is read from the image header without decoding it.
+    """
+    try:
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                image = f.read()
+        elif hasattr(image, 'read'):
+            position = image.tell()
+            data = image.read()
+            image.seek(position)
+            image = data
+
+        size = read_image_size(image)
+        if size is None:
+            # Not PNG/JPEG/GIF/BMP (e.g. TIFF); let PIL parse the header
+            from PIL import Image
+            with Image.open(io.BytesIO(image)) as img:
+                size = img.size
+        width, height = size
+        aspect_ratio = height / width
+        
+        # Calculate optimal width (max 4.5 inches to fit better in document)
+        optimal_width = min(max_width_inches, 4.5)
+        optimal_height = optimal_width * aspect_ratio
+        
+        # If height is too large, adjust based on height constraint
+        if optimal_height > 3:  # Max 3 inches height
+            optimal_height = 3
+            optimal_width = optimal_height / aspect_ratio
+        
+        # Ensure minimum readable size
+        if optimal_width < 2:
+            optimal_width = 2
+            optimal_height = optimal_width * aspect_ratio
+        
+        return Inches(optimal_width), Inches(optimal_height)
+    except Exception as e:
+        print(f"Could not read image size: {e}")
+        # Default smaller size if the image size is unknown
+        return Inches(4), Inches(3)
+
+def load_embedded_image(doc, r_id):
+    """
+    Return the bytes of the image part behind relationship *r_id*.
+    The image comes straight from the already-opened package, so nothing
+    is extracted to disk. Returns None if *r_id* does not point at an image.
+    """
+    image_part = doc.part.related_parts.get(r_id)
+    if image_part is None or not image_part.content_type.startswith('image/'):
+        return None
+    return image_part.blob
+
+# Style references inside a table and the style type each one names
+TABLE_STYLE_REFS = {
+    qn('w:tblStyle'): WD_STYLE_TYPE.TABLE,
+    qn('w:pStyle'): WD_STYLE_TYPE.PARAGRAPH,
+    qn('w:rStyle'): WD_STYLE_TYPE.CHARACTER,
+}
+# References to parts a cloned table cannot carry over to the new document
+UNSUPPORTED_TABLE_TAGS = {
+    qn('w:footnoteReference'), qn('w:endnoteReference'), qn('w:commentReference'),
+    qn('w:commentRangeStart'), qn('w:commentRangeEnd'),
+}
+R_NAMESPACE = '{%s}' % nsmap['r']
+W_NUMPR = qn('w:numPr')
+WP_DOCPR = qn('wp:docPr')
+
+def remap_style_id(style_id, style_type, src_styles, dest_styles, style_map):
+    """Return the destination style ID for source *style_id*, or None if there is no equivalent"""
+    key = (style_id, style_type)
+    if key not in style_map:
+        dest_style = dest_styles.get_by_id(style_id)
+        if dest_style is None or dest_style.type != style_type:
+            # Fall back to a destination style with the same name
+            src_style = src_styles.get_by_id(style_id)
+            dest_style = dest_styles.get_by_name(src_style.name_val) if src_style is not None else None
+            if dest_style is not None and dest_style.type != style_type:
+                dest_style = None
+        style_map[key] = dest_style.styleId if dest_style is not None else None
+    return style_map[key]
+
+def remap_relationship(r_id, src_part, dest_part):
+    """Recreate relationship *r_id* of *src_part* on *dest_part* and return the new rId, or None if unsupported"""
+    rel = src_part.rels.get(r_id)
+    if rel is None:
+        return None
+    if rel.is_external:
+        if rel.reltype not in (RT.HYPERLINK, RT.IMAGE):
+            return None
+        return dest_part.relate_to(rel.target_ref, rel.reltype, is_external=True)
+    if rel.reltype == RT.IMAGE:
+        new_r_id, _ = dest_part.get_or_add_image(io.BytesIO(rel.target_part.blob))
+        return new_r_id
+    return None
+
+def renumber_drawings(doc_prs, dest):
+    """
+    Give the wp:docPr elements *doc_prs*, about to be added to a document, the next free
+    drawing IDs of *dest* (its part, or the StreamingWriter writing it), in order.
+    """
+    if not doc_prs:
+        return
+    # Drawing IDs must stay unique within the destination document
+    next_id = dest.next_id
+    for doc_pr in doc_prs:
+        if doc_pr.get('name') == f"Picture {doc_pr.get('id')}":
+            # python-docx names pictures after their ID
+            doc_pr.set('name', f"Picture {next_id}")
+        doc_pr.set('id', str(next_id))
+        next_id += 1
+
+def clone_table_element(src_table, dest_doc, style_map=None, dest_part=None):
+    """
+    Return a deep copy of *src_table*'s w:tbl element ready to insert into *dest_doc*.
+    Style IDs are mapped onto *dest_doc*'s styles, images and hyperlinks get
+    new relationships on *dest_part* (*dest_doc*'s part by default), and list
+    numbering is dropped. Returns None if the table holds anything else that
+    refers to another part of the source.
+    """
+    tbl = deepcopy(src_table._tbl)
+    src_part = src_table.part
+    dest_part = dest_part or dest_doc.part
+    src_styles = src_part._styles_part.element
+    dest_styles = dest_doc.part._styles_part.element
+    style_map = {} if style_map is None else style_map
+    removed = []
+    doc_prs = []
+
+    for el in tbl.iter():
+        tag = el.tag
+        if not isinstance(tag, str):
+            continue  # XML comments and processing instructions
+        if tag in UNSUPPORTED_TABLE_TAGS:
+            return None
+        if tag in TABLE_STYLE_REFS:
+            style_id = remap_style_id(el.get(qn('w:val')), TABLE_STYLE_REFS[tag],
+                                      src_styles, dest_styles, style_map)
+            if style_id is None:
+                removed.append(el)
+            else:
+                el.set(qn('w:val'), style_id)
+        elif tag == W_NUMPR:
+            removed.append(el)
+        elif tag == WP_DOCPR:
+            doc_prs.append(el)
+
+        for name, value in el.attrib.items():
+            if name.startswith(R_NAMESPACE):
+                new_r_id = remap_relationship(value, src_part, dest_part)
+                if new_r_id is None:
+                    return None
+                el.set(name, new_r_id)
+
+    for el in removed:
+        el.getparent().remove(el)
+
+    renumber_drawings(doc_prs, dest_part)
+    return tbl
+
+def copy_table(src_table, dest_doc, style_map=None, dest_part=None, run_styles=None):
+    """
+    Copy a table from source to destination document.
+    The table XML is cloned so merges, widths, shading and nested tables
+    survive; tables that cannot be cloned are copied cell by cell instead,
+    with *run_styles* (a run_styles.RunStyles) for their runs' formatting if given.
+    """
+    try:
+        tbl = clone_table_element(src_table, dest_doc, style_map, dest_part)
+    except Exception as e:
+        print(f"Could not clone table, copying cells instead: {e}")
+        tbl = None
+
+    if tbl is None:
+        return copy_table_cells(src_table, dest_doc, run_styles)
+
+    dest_doc.element.body._insert_tbl(tbl)
+    return Table(tbl, dest_doc._body)
+
+def copy_table_cells(src_table, dest_doc, run_styles=None):
+    """
+    Copy a table cell by cell, keeping only the text and basic run formatting.
+    The paragraphs of nested tables, content controls and text boxes in a
+    cell are kept too, flattened into the cell in document order. With
+    *run_styles* the formatting is applied through its character styles
+    rather than repeated on every run.
+    """
+    new_table = dest_doc.add_table(rows=len(src_table.rows), cols=len(src_table.columns))
+    new_table.style = src_table.style
+    
+    # Both cell grids are built once; row.cells builds the whole grid again for every row
+    for cell, new_cell in zip(src_table._cells, new_table._cells):
+        # Copy text and formatting by copying paragraphs
+        first_p = True
+        for item in walk(cell._tc):
+            if item.kind != 'paragraph':
+                continue
+            p = Paragraph(item.element, cell)
+            if first_p:
+                new_p = new_cell.paragraphs[0]
+                new_p.text = "" # clear default
+                first_p = False
+            else:
+                new_p = new_cell.add_paragraph()
+            
+            for run in p.runs:
+                new_run = new_p.add_run(run.text)
+                if run_styles is not None:
+                    style_id = run_styles.style_id(run._r.rPr)
+                    if style_id is not None:
+                        new_run._r.style = style_id
+                    continue
+                new_run.bold = run.bold
+                new_run.italic = run.italic
+                if run.font.size:
+                    new_run.font.size = run.font.size
+                if run.font.name:
+                    new_run.font.name = run.font.name
+
+    return new_table
+
+class BlockRenderer:
+    """
+    Builds the output of classified blocks in *new_doc*, one block at a time.
+
+    *doc* is the source (a python-docx Document or a SourceDocument) and
+    *writer* the StreamingWriter pictures and links go through, if any.
+    Stage times and item counts go to *timer*; the picture bytes before and
+    after downsampling add up in image_bytes_in and image_bytes_out.
+    """
+
+    def __init__(self, doc, new_doc, timer, writer=None, image_dpi=None, template=None, run_styles=None):
+        self.doc = doc
+        self.new_doc = new_doc
+        self.timer = timer
+        self.writer = writer
+        self.image_dpi = image_dpi
+        self.run_styles = run_styles
+        # Source-to-destination style IDs, shared by every table in the document
+        self.table_style_map = {}
+        self.list_number_style = template_style_id('List Number', WD_STYLE_TYPE.PARAGRAPH, template)
+        self.image_bytes_in = 0
+        self.image_bytes_out = 0
+
+    def render(self, block):
+        """Add the output of *block*, a classify.Block, to the document"""
+        doc, new_doc, timer, writer = self.doc, self.new_doc, self.timer, self.writer
+        image_dpi, run_styles = self.image_dpi, self.run_styles
+
+        if block.kind == 'table':
+            # Copy table to new document
+            with timer.stage('tables'):
+                copy_table(Table(block.element, doc), new_doc, self.table_style_map, writer, run_styles)
+            new_doc.add_paragraph() # spacing after table
+            timer.count('tables')
+            return
+
+        timer.count('runs', len(block.element.findall(W_R)))
+
+        text = block.text
+        category = block.category
+
+        if category == 'image':
+            image_start = time.perf_counter()
+            # Images usually follow current layout
+            new_para = new_doc.add_paragraph()
+            new_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            
+            image_added = False
+            # Add each drawing's own image, resolved through its relationship ID
+            for r_id in block.r_ids:
+                image_data = load_embedded_image(doc, r_id)
+                if image_data is None:
+                    continue
+                try:
+                    new_run = new_para.add_run()
+                    width, height = get_optimal_image_size(image_data)
+                    self.image_bytes_in += len(image_data)
+                    if image_dpi:
+                        image_data = optimize_image(image_data, width.inches, height.inches, image_dpi)
+                    self.image_bytes_out += len(image_data)
+                    if writer is not None:
+                        writer.add_picture(new_run, io.BytesIO(image_data), width, height)
+                    else:
+                        new_run.add_picture(io.BytesIO(image_data), width=width, height=height)
+                    image_added = True
+                    timer.count('images')
+                except Exception as img_error:
+                    print(f"Could not add image: {img_error}")
+            
+            if not image_added:
+                new_para.add_run("[Image placeholder]")
+            
+            if text:
+                caption_para = new_doc.add_paragraph(text)
+                caption_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                for run in caption_para.runs:
+                    run.font.size = Inches(0.12)
+                    run.italic = True
+            
+            new_doc.add_paragraph()
+            timer.add('images', time.perf_counter() - image_start)
+        elif category == 'empty':
+            return
+        elif category == 'references_heading':
+            heading_para = new_doc.add_paragraph()
+            heading_run = heading_para.add_run(text)
+            heading_run.bold = True
+            heading_run.font.size = Inches(0.16)
+            heading_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            new_doc.add_paragraph()
+        elif category == 'reference':
+            ref_para = new_doc.add_paragraph()
+            if self.list_number_style is not None:
+                # Set by ID, which skips a name lookup through the styles part per reference
+                ref_para._p.style = self.list_number_style
+            if run_styles is not None:
+                append_styled_runs(ref_para._p, block.element, run_styles)
+            else:
+                ref_para.add_run(text)
+        elif category == 'title':
+            heading_para = new_doc.add_paragraph()
+            heading_run = heading_para.add_run(text)
+            heading_run.bold = True
+            heading_run.font.size = Inches(0.18)
+            heading_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            new_doc.add_paragraph()
+        elif category in ('heading', 'special', 'subheading'):
+            # Subsequent uppercase headings, Abstract/Keywords, and Subheadings stay in 2 columns
+            heading_para = new_doc.add_paragraph()
+            heading_run = heading_para.add_run(text)
+            heading_run.bold = True
+            heading_run.font.size = Inches(0.14)
+            
+            if category == 'special':
+                heading_para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+            else:
+                heading_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
+                
+            new_doc.add_paragraph()
+        else:
+            # Normal paragraph, in 2 columns
+            if run_styles is not None:
+                new_para = new_doc.add_paragraph()
+                append_styled_runs(new_para._p, block.element, run_styles)
+            else:
+                new_para = new_doc.add_paragraph(text)
+            new_para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+            new_para.paragraph_format.space_after = Inches(0.1)
+
+def save_output(timer, new_doc, output_file=None, writer=None, image_bytes=(0, 0), rule_stats=None, stats=None):
+    """
+    Save the finished *new_doc* and return process_docx's result for it: the document
+    bytes when *output_file* is None, else True. *writer* is the StreamingWriter its body
+    was written with, if any. *image_bytes* is the pictures' (bytes in, bytes out); they,
+    the rule hits in *rule_stats* and *timer*'s stages and counts are recorded in *stats*.
+    """
+    image_bytes_in, image_bytes_out = image_bytes
+    if image_bytes_in != image_bytes_out:
+        print(f"Image optimization saved {image_bytes_in - image_bytes_out} bytes "
+              f"({image_bytes_in} -> {image_bytes_out})")
+
+    with timer.stage('save'):
+        if writer is not None:
+            writer.close()
+            result = writer.output_file.getvalue() if output_file is None else True
+        elif output_file is None:
+            output = io.BytesIO()
+            new_doc.save(output)
+            result = output.getvalue()
+        else:
+            new_doc.save(output_file)
+            result = True
+
+    if stats is not None:
+        stats.update(timer.as_dict())
+        stats['image_bytes_in'] = image_bytes_in
+        stats['image_bytes_out'] = image_bytes_out
+        stats['image_bytes_saved'] = image_bytes_in - image_bytes_out
+        stats['rules'] = rule_stats
+    return result
+
+def report_failure(error, writer=None):
+    """Log *error*, which stopped a document from being formatted, and discard what *writer* wrote"""
+    print(f"Error processing document: {str(error)}")
+    import traceback
+    traceback.print_exc()
+    if writer is not None:
+        writer.abort()
+
+def process_docx(input_file, output_file=None, footer_text="", image_dpi=None, stats=None, streaming=False,
+                 template=None, heading_rules=None, fragments=None, preserve_formatting=False):
+    """
+    Process DOCX file to make headings bold and arrange content in 2 columns.
+
+    *input_file* may be a path, a binary file-like object or the document
+    bytes. The result is saved to *output_file* (a path or a writable binary
+    file-like object) and True or False is returned. If *output_file* is None
+    the formatted document is returned as bytes instead, or None on failure.
+
+    With *image_dpi* set, pictures with more resolution than their display
+    size needs at that DPI are downsampled and recompressed. If *stats* is a
+    dict, the time spent in each stage, item counts and the image bytes
+    before and after are recorded in it.
+
+    With *streaming* the input body is parsed incrementally and the output
+    body is written out block by block (see streaming.py), so memory does
+    not grow with the length of the document. *template* is the path of a
+    house template .docx whose styles and page setup the output starts
+    from; python-docx's default template is used when it is None.
+    *heading_rules* is the path of a heading rules file (see
+    heading_rules.py) to categorize paragraphs with instead of the default
+    heading_rules.json.
+
+    With *preserve_formatting*, body paragraphs and references keep their
+    runs' bold, italic, sub/superscript, underline and font changes,
+    through one generated character style per distinct combination (see
+    run_styles.py) instead of being written as plain text.
+
+    With a fragment_cache.FragmentCache as *fragments*, blocks that were
+    formatted before under the same settings (e.g. the unchanged
+    paragraphs of a revised manuscript) are copied from the cache instead
+    of being classified and built again.
+    """
+    timer = StageTimer()
+    doc = writer = None
+    try:
+        if isinstance(input_file, (bytes, bytearray)):
+            input_file = io.BytesIO(input_file)
+
+        # Open the document
+        with timer.stage('open'):
+            if streaming:
+                doc = SourceDocument(input_file)
+                body = doc.iter_blocks()
+            else:
+                doc = Document(input_file)
+                body = doc.element.body
+        
+        with timer.stage('setup'):
+            # Create new document for output from the cached, already parsed template
+            new_doc = new_document(template)
+            
+            # Configure initial section as 1-column for title
+            configure_section(new_doc.sections[0], columns=1, footer_text=footer_text)
+            if streaming:
+                output = io.BytesIO() if output_file is None else output_file
+                writer = StreamingWriter(new_doc, output)
+        current_columns = 1
+        section_count = 1
+        
+        rules = load_rules(heading_rules)
+        rule_stats = {} if stats is not None else None
+        run_styles = RunStyles(new_doc, doc.part._styles_part.element) if preserve_formatting else None
+        renderer = BlockRenderer(doc, new_doc, timer, writer, image_dpi, template, run_styles)
+
+        session = None
+        if fragments is not None:
+            context = (f"{FORMATTER_VERSION}/{image_dpi}/{template_key(template)}/{rules_key(heading_rules)}"
+                       f"/{bool(preserve_formatting)}")
+            session = FragmentSession(fragments, new_doc, writer or new_doc.part, doc.part, context, run_styles)
+            if writer is not None:
+                image_blob = writer.image_blob
+            else:
+                image_blob = lambda r_id: new_doc.part.related_parts[r_id].blob
+
+        # Classify all block items (paragraphs and tables) in a single pass, in order
+        loop_start = time.perf_counter()
+        for block in timer.timed_iter('classify', classify_blocks(body, rules, rule_stats,
+                                                                  session and session.known)):
+            timer.count('blocks')
+            if block.container != 'body':
+                timer.count(f'{block.container}_blocks')
+            if session is not None:
+                # Keep what the previous block added for the next revision
+                with timer.stage('fragments'):
+                    session.finish_block(timer.counts, image_blob)
+            if writer is not None:
+                # Write out what the previous block added
+                with timer.stage('write'):
+                    writer.flush()
+
+            columns = section_change(block.category, current_columns)
+            if columns is not None:
+                with timer.stage('sections'):
+                    start_section(new_doc, columns=columns)
+                current_columns = columns
+                section_count += 1
+
+            if session is not None:
+                with timer.stage('fragments'):
+                    if session.reuse(block.element, timer.counts):
+                        if block.kind == 'paragraph':
+                            timer.count('runs', len(block.element.findall(W_R)))
+                        continue
+                    session.start_block(block.element, block.category, timer.counts)
+
+            renderer.render(block)
+
+        if session is not None:
+            with timer.stage('fragments'):
+                session.finish_block(timer.counts, image_blob)
+            timer.count('fragments_reused', session.reused)
+            timer.count('fragments_built', session.built)
+
+        # Whatever the loop spent outside the timed stages went on plain paragraphs
+        timer.add('paragraphs', time.perf_counter() - loop_start - sum(
+            timer.stages[name] for name in ('classify', 'tables', 'images', 'sections', 'write', 'fragments')))
+        timer.count('sections', section_count)
+        if run_styles is not None:
+            timer.count('run_styles', len(run_styles))
+
+        result = save_output(timer, new_doc, output_file, writer,
+                             (renderer.image_bytes_in, renderer.image_bytes_out), rule_stats, stats)
+        if stats is not None and session is not None:
+            stats['fragment_reuse'] = session.reused / max(session.reused + session.built, 1)
+        return result
+    except Exception as e:
+        report_failure(e, writer)
+        return None if output_file is None else False
+    finally:
+        if isinstance(doc, SourceDocument):
+            doc.close()
+
+def format_docx_job(data, footer_text="", options=None, profile=False, executor=None, input_path=None,
+                    workspace=None):
+    """
+    Format a DOCX given as bytes and return (output bytes, stats) (job worker entry point).
+    *options* is a FormatOptions. With *profile* the run is made under
+    cProfile and the summary is added to stats['profile']. Given a process
+    pool *executor*, inputs of at least options.parallel_min_size are
+    formatted in chunks on it (see parallel.py); pool workers must not
+    pass their own pool. The chunk workers read *input_path* when the
+    bytes are already in a file there, or else a copy made in *workspace*.
+    """
+    options = options or FormatOptions()
+    if executor is not None and options.parallel_min_size and len(data) >= options.parallel_min_size:
+        from parallel import process_docx_parallel
+
+        stats = {}
+        source = input_path or data
+        if profile:
+            output, stats['profile'] = profile_call(process_docx_parallel, source, footer_text=footer_text,
+                                                    options=options, executor=executor, stats=stats,
+                                                    workspace=workspace)
+        else:
+            output = process_docx_parallel(source, footer_text=footer_text, options=options, executor=executor,
+                                           stats=stats, workspace=workspace)
+        if output is None:
+            raise ValueError('Error processing document')
+        return output, stats
+
+    kwargs = {
+        'footer_text': footer_text,
+        'image_dpi': options.image_dpi,
+        'streaming': len(data) >= options.streaming_min_size,
+        'template': options.template,
+        'heading_rules': options.heading_rules,
+        'preserve_formatting': options.preserve_formatting,
+    }
+    if options.fragment_cache_bytes:
+        kwargs['fragments'] = shared_fragment_cache(options.fragment_cache_bytes)
+    stats = {}
+    if profile:
+        output, stats['profile'] = profile_call(process_docx, data, stats=stats, **kwargs)
+    else:
+        output = process_docx(data, stats=stats, **kwargs)
+    if output is None:
+        raise ValueError('Error processing document')
+    return output, stats
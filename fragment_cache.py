@@ -0,0 +1,313 @@
+"""
+Per-block fragment cache for reformatting revised manuscripts.
+
+A revision usually changes a handful of paragraphs, yet every block used
+to be classified and rebuilt again, pictures re-sized and re-embedded and
+tables re-cloned. With a FragmentCache, process_docx keys each source
+block by a hash of its XML, the parts it refers to (picture bytes,
+hyperlink targets), the table styles it names and the classifier state
+(title_found, in_references) before it, under the run's settings. A
+block seen before is not classified again; the output elements it
+produced last time are copied into the new document instead, with its
+pictures and hyperlinks related to the new document and drawing IDs
+renumbered. Fragments are kept in memory under a byte budget with
+least-recently-used eviction, so each worker process keeps its own.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import nsmap, qn
+from lxml import etree
+
+from classify import W_TBL
+
+FRAGMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+WP_DOCPR = qn('wp:docPr')
+W_RSTYLE = qn('w:rStyle')
+W_SECTPR = qn('w:sectPr')
+TABLE_STYLE_TAGS = (qn('w:tblStyle'), qn('w:pStyle'), qn('w:rStyle'))
+
+# category: the block's classifier category
+# elements: output body elements the block produced, in order
+# rels: rId used in *elements* -> ('image', bytes) or ('external', reltype, target)
+# counts: item counts (tables, images) building the block added
+# styles: generated character style ID used in *elements* -> its run_styles properties key
+Fragment = namedtuple('Fragment', ['category', 'elements', 'rels', 'counts', 'size', 'styles'])
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_fragment_cache(max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+    """Return this process's FragmentCache, created on first use and resized to *max_bytes*"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = FragmentCache(max_bytes)
+        elif _shared_cache.max_bytes != max_bytes:
+            _shared_cache.max_bytes = max_bytes
+            _shared_cache.evict()
+        return _shared_cache
+
+
+def shared_fragment_cache_stats():
+    """Return the stats() of this process's FragmentCache, all zero if none has been used yet"""
+    with _shared_cache_lock:
+        cache = _shared_cache
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0, 'bytes': 0}
+    return cache.stats()
+
+
+_r_attributes = etree.XPath(f'descendant-or-self::*/@*[namespace-uri()="{nsmap["r"]}"]')
+
+
+def _relationship_attrs(element):
+    """Yield (element, attribute name, rId) for every relationship reference in *element*"""
+    for value in _r_attributes(element):
+        yield value.getparent(), value.attrname, str(value)
+
+
+def _body_sectPr(body):
+    """Return the w:sectPr of *body*, which is always its last child, without walking the body for it"""
+    for last in body.iterchildren(reversed=True):
+        return last if last.tag == W_SECTPR else None
+    return None
+
+
+def output_dependencies(elements, part, image_blob, run_styles=None):
+    """
+    Return (rels, styles) for output *elements* of the document whose part is *part*, as
+    kept in a Fragment, or None if they refer to something insert_output() cannot rebuild.
+    *image_blob(r_id)* returns the bytes of a picture the elements show.
+    """
+    rels = {}
+    for element in elements:
+        for _, _, r_id in _relationship_attrs(element):
+            if r_id in rels:
+                continue
+            rel = part.rels.get(r_id)
+            if rel is None:
+                return None
+            if rel.is_external:
+                rels[r_id] = ('external', rel.reltype, rel.target_ref)
+            elif rel.reltype == RT.IMAGE:
+                rels[r_id] = ('image', image_blob(r_id))
+            else:
+                return None  # Nothing else is related by process_docx
+
+    styles = {}
+    if run_styles is not None:
+        for element in elements:
+            for el in element.iter(W_RSTYLE):
+                style_id = el.get(qn('w:val'))
+                properties = run_styles.key(style_id)
+                if properties is not None:
+                    styles[style_id] = properties
+    return rels, styles
+
+
+def insert_output(elements, rels, styles, new_doc, dest, run_styles=None):
+    """
+    Add output *elements* made for another document to the end of *new_doc*'s body.
+    Pictures and hyperlinks in *rels* are related again through *dest* (the StreamingWriter,
+    or *new_doc*'s part), drawing IDs renumbered and the character styles in *styles*
+    added to *run_styles*. The elements are changed in place.
+    """
+    # Imported here, as formatter imports this module
+    from formatter import renumber_drawings
+
+    new_r_ids = {}
+    for r_id, rel in rels.items():
+        if rel[0] == 'image':
+            new_r_ids[r_id], _ = dest.get_or_add_image(io.BytesIO(rel[1]))
+        else:
+            new_r_ids[r_id] = dest.relate_to(rel[2], rel[1], is_external=True)
+    doc_prs = []
+    for element in elements:
+        if rels:
+            for el, name, r_id in _relationship_attrs(element):
+                el.set(name, new_r_ids[r_id])
+        doc_prs.extend(element.iter(WP_DOCPR))
+        if styles:
+            # Generated character styles exist only in the document they were made for; add them to this one
+            for el in element.iter(W_RSTYLE):
+                properties = styles.get(el.get(qn('w:val')))
+                if properties is not None:
+                    el.set(qn('w:val'), run_styles.style_id_for_key(properties))
+    renumber_drawings(doc_prs, dest)
+
+    body = new_doc.element.body
+    sectPr = _body_sectPr(body)
+    for element in elements:
+        if sectPr is not None:
+            sectPr.addprevious(element)
+        else:
+            body.append(element)
+
+
+class FragmentCache:
+    """Size-bounded LRU store of Fragments, shared by every document formatted in the process"""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()  # key -> Fragment
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key, fragment):
+        if fragment.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = fragment
+            self.size += fragment.size
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            while self.size > self.max_bytes and self._entries:
+                _, fragment = self._entries.popitem(last=False)
+                self.size -= fragment.size
+                self.evictions += 1
+
+    def copy_elements(self, fragment):
+        """Return fresh copies of *fragment*'s elements (lxml trees are not copied concurrently)"""
+        with self._lock:
+            return [deepcopy(el) for el in fragment.elements]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.size}
+
+
+class FragmentSession:
+    """
+    One process_docx run's use of a FragmentCache.
+
+    known() is the classify_blocks hook that looks each block up; reuse()
+    copies a hit's fragment into *new_doc*. For every other block,
+    start_block() marks where its output begins and finish_block() stores
+    what it added. *dest* is where pictures and hyperlinks are related
+    (the StreamingWriter, or *new_doc*'s part), *source_part* the input's
+    document part and *context* a string naming every setting that
+    changes the output. *run_styles* is the run's run_styles.RunStyles,
+    if it preserves run formatting.
+    """
+
+    def __init__(self, cache, new_doc, dest, source_part, context, run_styles=None):
+        self.cache = cache
+        self.run_styles = run_styles
+        self.new_doc = new_doc
+        self.dest = dest
+        self.source_part = source_part
+        self.context = context.encode('utf-8')
+        self.reused = 0
+        self.built = 0
+        # known() runs for the next block before the current one is finished, so its result is kept apart
+        self._hit = None      # (element, Fragment) known() found
+        self._miss = None     # (element, key) known() did not find
+        self._pending = None  # (key, category, start index, counts) of the block being built
+
+    def _key(self, element, title_found, in_references):
+        digest = hashlib.sha1(self.context)
+        digest.update(b'%d%d' % (title_found, in_references))
+        digest.update(etree.tostring(element))
+        for _, _, r_id in _relationship_attrs(element):
+            rel = self.source_part.rels.get(r_id)
+            if rel is None:
+                digest.update(b'\0missing')
+            elif rel.is_external:
+                digest.update(b'\0' + rel.target_ref.encode('utf-8'))
+            else:
+                digest.update(b'\0' + hashlib.sha1(rel.target_part.blob).digest())
+        if element.tag == W_TBL:
+            # Table styles are mapped by the name the source gives them
+            styles = self.source_part._styles_part.element
+            for el in element.iter(*TABLE_STYLE_TAGS):
+                style = styles.get_by_id(el.get(qn('w:val')))
+                digest.update(b'\0' + (style.name_val if style is not None else '').encode('utf-8'))
+        elif self.run_styles is not None:
+            # Preserved runs take the properties their source character styles set
+            for el in element.iter(W_RSTYLE):
+                properties = self.run_styles.style_properties(el.get(qn('w:val')))
+                digest.update(b'\0' + repr(sorted(properties.items())).encode('utf-8'))
+        return digest.digest()
+
+    def known(self, element, title_found, in_references):
+        """Return the category of *element* if its fragment is cached, else None (classify_blocks hook)"""
+        key = self._key(element, title_found, in_references)
+        fragment = self.cache.get(key)
+        if fragment is None:
+            self._miss = (element, key)
+            return None
+        self._hit = (element, fragment)
+        return fragment.category
+
+    def reuse(self, element, counts):
+        """Copy the cached fragment for *element* into the document; returns False if it has none"""
+        if self._hit is None or self._hit[0] is not element:
+            return False
+        fragment = self._hit[1]
+        self._hit = None
+
+        insert_output(self.cache.copy_elements(fragment), fragment.rels, fragment.styles,
+                      self.new_doc, self.dest, self.run_styles)
+        for name, n in fragment.counts.items():
+            counts[name] += n
+        self.reused += 1
+        return True
+
+    def start_block(self, element, category, counts):
+        """Mark the start of *element*'s output, to be stored by finish_block()"""
+        if self._miss is None or self._miss[0] is not element:
+            return
+        key = self._miss[1]
+        self._miss = None
+        body = self.new_doc.element.body
+        start = len(body) - (1 if _body_sectPr(body) is not None else 0)
+        self._pending = (key, category, start, {name: counts[name] for name in ('tables', 'images')})
+
+    def finish_block(self, counts, image_blob):
+        """
+        Store the output of the block being built as its fragment.
+        *image_blob(r_id)* returns the bytes of a picture the block added.
+        """
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        key, category, start, start_counts = pending
+        self.built += 1
+
+        elements = [el for el in self.new_doc.element.body[start:] if el.tag != W_SECTPR]
+        dependencies = output_dependencies(elements, self.new_doc.part, image_blob, self.run_styles)
+        if dependencies is None:
+            return  # Do not cache what we cannot rebuild
+        rels, styles = dependencies
+
+        elements = [deepcopy(el) for el in elements]
+        size = sum(len(etree.tostring(el)) for el in elements)
+        size += sum(len(rel[1]) for rel in rels.values() if rel[0] == 'image')
+        block_counts = {name: counts[name] - n for name, n in start_counts.items() if counts[name] != n}
+        self.cache.put(key, Fragment(category, tuple(elements), rels, block_counts, size, styles))
@@ -0,0 +1,131 @@
+"""
+Image sizing and optimization for embedded pictures.
+
+read_image_size() gets pixel dimensions from the PNG, JPEG, GIF or BMP
+header without decoding the image. optimize_image() downsamples pictures
+whose resolution exceeds what their display size needs at a target DPI and
+recompresses them; results are cached by content hash so the same figure
+is only processed once per worker process.
+"""
+import hashlib
+import io
+import math
+import struct
+import threading
+from collections import OrderedDict
+
+# Downsample only when the image has this much more resolution than needed
+DOWNSAMPLE_SLACK = 1.25
+JPEG_QUALITY = 85
+OPTIMIZED_CACHE_SIZE = 256
+
+_optimized_cache = OrderedDict()
+_optimized_cache_lock = threading.Lock()
+
+
+def read_image_size(data):
+    """Return (width, height) in pixels from the image header, or None if the format is not recognised"""
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', data[6:10])
+        if data[:2] == b'BM':
+            header_size = struct.unpack('<I', data[14:18])[0]
+            if header_size == 12:  # OS/2 BITMAPCOREHEADER
+                return struct.unpack('<HH', data[18:22])
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+        if data[:2] == b'\xff\xd8':
+            return _read_jpeg_size(data)
+    except struct.error:
+        pass
+    return None
+
+
+def _read_jpeg_size(data):
+    # Walk the marker segments up to the first start-of-frame
+    pos = 2
+    length = len(data)
+    while pos + 4 <= length:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            pos += 2
+            continue
+        segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + segment_length
+    return None
+
+
+def optimize_image(data, display_width_inches, display_height_inches, target_dpi=200):
+    """
+    Return *data* downsampled to *target_dpi* at its display size and recompressed.
+
+    The original bytes are returned unchanged when the image is not a PNG,
+    JPEG or BMP, already has no more resolution than needed, or would not
+    get any smaller.
+    """
+    digest = hashlib.sha1(data).digest()
+    key = (digest, round(display_width_inches, 3), round(display_height_inches, 3), target_dpi)
+    with _optimized_cache_lock:
+        if key in _optimized_cache:
+            _optimized_cache.move_to_end(key)
+            return _optimized_cache[key]
+
+    try:
+        optimized = _optimize(data, display_width_inches, display_height_inches, target_dpi)
+    except Exception as e:
+        print(f"Could not optimize image: {e}")
+        optimized = data
+
+    with _optimized_cache_lock:
+        _optimized_cache[key] = optimized
+        if len(_optimized_cache) > OPTIMIZED_CACHE_SIZE:
+            _optimized_cache.popitem(last=False)
+    return optimized
+
+
+def _optimize(data, display_width_inches, display_height_inches, target_dpi):
+    size = read_image_size(data)
+    if size is None or data[:6] in (b'GIF87a', b'GIF89a'):
+        # Unknown formats and (possibly animated) GIFs are embedded as they are
+        return data
+
+    width, height = size
+    target_width = math.ceil(display_width_inches * target_dpi)
+    target_height = math.ceil(display_height_inches * target_dpi)
+    too_large = width > target_width * DOWNSAMPLE_SLACK and height > target_height * DOWNSAMPLE_SLACK
+    is_bmp = data[:2] == b'BM'
+    if not too_large and not is_bmp:
+        return data
+
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        image_format = img.format
+        exif = img.info.get('exif')
+        if too_large:
+            img = img.resize((target_width, target_height), Image.LANCZOS)
+
+        output = io.BytesIO()
+        if image_format == 'JPEG':
+            save_args = {'quality': JPEG_QUALITY, 'optimize': True}
+            if exif:
+                save_args['exif'] = exif
+            img.save(output, format='JPEG', **save_args)
+        else:
+            # PNG stays PNG; uncompressed BMP is stored as PNG instead
+            if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+                img = img.convert('RGBA')
+            img.save(output, format='PNG', optimize=True)
+
+    optimized = output.getvalue()
+    return optimized if len(optimized) < len(data) else data
@@ -0,0 +1,229 @@
+"""
+Background formatting jobs.
+
+Jobs run in a bounded ProcessPoolExecutor so CPU-bound formatting can use
+every core while the web worker returns immediately. The number of
+unfinished jobs is capped; once the cap is reached submit() raises
+QueueFullError and the caller should answer 429. Jobs submitted with the
+same key while one is still running share that run instead of starting
+another.
+"""
+import os
+import threading
+import time
+import uuid
+
+
+def _worker_context():
+    """
+    The multiprocessing context pool workers are started with. The pool is created
+    lazily, from a process whose request threads may hold locks (templates, caches,
+    logging), and a child forked then would inherit them held; workers are started
+    from a fork server instead, which only ever imports the formatter.
+    """
+    import multiprocessing
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['formatter'])
+    return context
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds its maximum number of unfinished jobs"""
+
+
+class TaskExecutor:
+    """A JobQueue's pool as a concurrent.futures executor, for code that takes one; see JobQueue.submit_task"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._max_workers = queue.max_workers  # As on ProcessPoolExecutor, for sizing work to the pool
+
+    def submit(self, fn, *args):
+        return self.queue.submit_task(fn, *args)
+
+
+class JobQueue:
+    """Track jobs submitted to a shared process pool"""
+
+    def __init__(self, max_workers=None, max_pending=32, result_ttl=600):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = None
+        self._jobs = {}
+        self._inflight = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """The process pool, created on first use"""
+        with self._lock:
+            if self._executor is None:
+                # Imported on first use so app start-up does not pay for multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_worker_context())
+            return self._executor
+
+    def submit(self, fn, *args, filename=None, key=None, on_done=None):
+        """
+        Queue ``fn(*args)`` and return the new job ID.
+
+        If a job with the same *key* is still unfinished, the new job waits
+        on that run instead of queueing another one. *on_done* is called
+        with the finished future when this submission started a run of its
+        own.
+        """
+        self._expire_finished()
+        job = self._new_job(filename)
+
+        with self._lock:
+            future = self._inflight.get(key) if key is not None else None
+            if future is None:
+                if self._pending >= self.max_pending:
+                    raise QueueFullError(f"{self._pending} jobs already pending")
+                self._pending += 1
+            self._jobs[job['id']] = job
+
+        if future is None:
+            try:
+                future = self._submit(fn, *args)
+            except Exception:
+                with self._lock:
+                    self._pending -= 1
+                    del self._jobs[job['id']]
+                raise
+            if key is not None:
+                with self._lock:
+                    self._inflight[key] = future
+            future.add_done_callback(lambda f: self._release(key, f))
+            if on_done is not None:
+                future.add_done_callback(on_done)
+
+        job['future'] = future
+        future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        return job['id']
+
+    def submit_task(self, fn, *args):
+        """
+        Run ``fn(*args)`` on the pool and return its future, for work that is part of a
+        request rather than a job of its own (the chunks of a parallel upload). The task
+        counts as pending until it finishes but is never refused: callers check full
+        before starting work they would otherwise have to abandon halfway.
+        """
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(lambda f: self._release(None, f))
+        return future
+
+    @property
+    def task_executor(self):
+        """An executor whose submit() is submit_task()"""
+        return TaskExecutor(self)
+
+    def add_finished(self, result, filename=None):
+        """Record an already-available result (e.g. a cache hit) as a finished job and return its ID"""
+        self._expire_finished()
+        job = self._new_job(filename)
+        job['result'] = result
+        job['finished'] = time.time()
+        with self._lock:
+            self._jobs[job['id']] = job
+        return job['id']
+
+    def _new_job(self, filename):
+        return {
+            'id': uuid.uuid4().hex,
+            'filename': filename,
+            'submitted': time.time(),
+            'finished': None,
+            'error': None,
+            'result': None,
+            'future': None,
+        }
+
+    def _submit(self, fn, *args):
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            return self.executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died and took the pool with it; start a fresh one
+            with self._lock:
+                self._executor = None
+            return self.executor.submit(fn, *args)
+
+    def _release(self, key, future):
+        with self._lock:
+            self._pending -= 1
+            if key is not None and self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _finish(self, job, future):
+        try:
+            job['result'] = future.result()
+        except Exception as e:
+            job['error'] = str(e) or e.__class__.__name__
+        job['finished'] = time.time()
+
+    def _expire_finished(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] is not None and job['finished'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def status(self, job_id):
+        """Return a JSON-serializable status dict for *job_id*, or None if it is unknown"""
+        self._expire_finished()
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job['future']
+        if job['finished'] is not None:
+            state = 'failed' if job['error'] else 'done'
+        elif future is not None and future.running():
+            state = 'running'
+        else:
+            state = 'queued'
+
+        return {
+            'id': job_id,
+            'status': state,
+            'filename': job['filename'],
+            'submitted': job['submitted'],
+            'finished': job['finished'],
+            'error': job['error'],
+        }
+
+    @property
+    def pending(self):
+        """Number of unfinished runs"""
+        return self._pending
+
+    @property
+    def full(self):
+        """Whether submit() would raise QueueFullError for a new run"""
+        return self._pending >= self.max_pending
+
+    def result(self, job_id):
+        """Return the result of a finished job, or None if it is unknown or not done"""
+        job = self._jobs.get(job_id)
+        if job is None or job['finished'] is None:
+            return None
+        return job['result']
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
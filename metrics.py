@@ -0,0 +1,196 @@
+"""
+Formatter instrumentation.
+
+StageTimer collects per-stage wall time and item counts inside one
+process_docx call; the result is a plain dict so it can travel back from
+worker processes. FormatterMetrics aggregates those dicts in the web
+process and renders them, with any extra metrics, in the Prometheus text
+exposition format for the /metrics endpoint.
+"""
+import io
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROFILE_LINES = 25
+
+
+class StageTimer:
+    """Accumulate wall time per stage and item counts for one formatter run"""
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def timed_iter(self, name, iterable):
+        """Yield from *iterable*, charging the time spent producing each item to stage *name*"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stages[name] += time.perf_counter() - start
+                return
+            self.stages[name] += time.perf_counter() - start
+            yield item
+
+    def add(self, name, seconds):
+        self.stages[name] += seconds
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def as_dict(self):
+        return {
+            'seconds': time.perf_counter() - self._start,
+            'stages': dict(self.stages),
+            'counts': dict(self.counts),
+        }
+
+
+def profile_call(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` under cProfile and return (result, top functions by cumulative time)"""
+    # Only the sampled documents pay for importing the profiler
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return result, summary.getvalue()
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts, total = self.series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self.series[labels] = (counts, total + value)
+
+    def render(self, name, label_names):
+        for labels, (counts, total) in sorted(self.series.items()):
+            base = _labels(label_names, labels)
+            for bound, count in zip(self.buckets, counts):
+                yield f'{name}_bucket{_labels(label_names + ("le",), labels + (repr(float(bound)),))} {count}'
+            yield f'{name}_bucket{_labels(label_names + ("le",), labels + ("+Inf",))} {counts[-1]}'
+            yield f'{name}_sum{base} {total}'
+            yield f'{name}_count{base} {counts[-1]}'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class FormatterMetrics:
+    """Process-wide formatter counters and latency histograms"""
+
+    def __init__(self):
+        self.documents = defaultdict(int)        # (source, outcome) -> count
+        self.items = defaultdict(int)            # kind -> count
+        self.image_bytes_saved = 0
+        self.rule_hits = defaultdict(int)        # heading rule name -> paragraphs it decided
+        self.rule_seconds = defaultdict(float)   # heading rule name -> time spent matching those paragraphs
+        self.duration = Histogram()              # (source,)
+        self.stage_duration = Histogram()        # (stage,)
+        self._lock = threading.Lock()
+
+    def observe(self, source, outcome, stats=None):
+        """Record one formatted document; *stats* is the dict process_docx filled in, if any"""
+        with self._lock:
+            self.documents[(source, outcome)] += 1
+            if not stats:
+                return
+            self.duration.observe((source,), stats.get('seconds', 0.0))
+            for stage, seconds in stats.get('stages', {}).items():
+                self.stage_duration.observe((stage,), seconds)
+            for kind, count in stats.get('counts', {}).items():
+                self.items[kind] += count
+            self.image_bytes_saved += stats.get('image_bytes_saved', 0)
+            for rule, (hits, seconds) in stats.get('rules', {}).items():
+                self.rule_hits[rule] += hits
+                self.rule_seconds[rule] += seconds
+
+    def render(self, extra=None):
+        """
+        Return the Prometheus text exposition of these metrics.
+        *extra* adds simple metrics from elsewhere, as {name: (type, help, value)}.
+        """
+        with self._lock:
+            lines = [
+                '# HELP docx_documents_total Documents formatted, by entry point and outcome',
+                '# TYPE docx_documents_total counter',
+            ]
+            for (source, outcome), count in sorted(self.documents.items()):
+                lines.append(f'docx_documents_total{_labels(("source", "outcome"), (source, outcome))} {count}')
+
+            lines += [
+                '# HELP docx_format_seconds Time spent in process_docx per document',
+                '# TYPE docx_format_seconds histogram',
+            ]
+            lines.extend(self.duration.render('docx_format_seconds', ('source',)))
+
+            lines += [
+                '# HELP docx_stage_seconds Time spent in each process_docx stage per document',
+                '# TYPE docx_stage_seconds histogram',
+            ]
+            lines.extend(self.stage_duration.render('docx_stage_seconds', ('stage',)))
+
+            lines += [
+                '# HELP docx_items_total Blocks, runs, tables, images and sections processed',
+                '# TYPE docx_items_total counter',
+            ]
+            for kind, count in sorted(self.items.items()):
+                lines.append(f'docx_items_total{_labels(("kind",), (kind,))} {count}')
+
+            lines += [
+                '# HELP docx_image_bytes_saved_total Bytes saved by image downsampling',
+                '# TYPE docx_image_bytes_saved_total counter',
+                f'docx_image_bytes_saved_total {self.image_bytes_saved}',
+            ]
+
+            lines += [
+                '# HELP docx_heading_rule_hits_total Paragraphs categorized by each heading rule',
+                '# TYPE docx_heading_rule_hits_total counter',
+            ]
+            for rule, hits in sorted(self.rule_hits.items()):
+                lines.append(f'docx_heading_rule_hits_total{_labels(("rule",), (rule,))} {hits}')
+            lines += [
+                '# HELP docx_heading_rule_seconds_total Time spent matching the paragraphs each heading rule decided',
+                '# TYPE docx_heading_rule_seconds_total counter',
+            ]
+            for rule, seconds in sorted(self.rule_seconds.items()):
+                lines.append(f'docx_heading_rule_seconds_total{_labels(("rule",), (rule,))} {seconds}')
+
+        for name, (metric_type, help_text, value) in sorted((extra or {}).items()):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
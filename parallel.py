@@ -0,0 +1,278 @@
+"""
+Multi-core formatting of one large document.
+
+process_docx builds a document in a single loop, so a book-length
+manuscript keeps one core busy however many the machine has.
+process_docx_parallel() spreads that loop over a process pool instead.
+A first pass in the calling process streams the body, classifies it and
+cuts it into chunks where a block switches columns or starts a heading,
+noting the little state the classifier carries from block to block
+(title_found, in_references) at each cut. The input is handed to the
+workers once, as a file they all read: each chunk carries only its own
+body XML, and a worker loads the package's other parts (styles,
+relationships, the pictures it shows) from that file as it needs them.
+The workers classify and render their chunk with format_chunk(),
+starting from that state, and
+send back the output body elements as XML with the pictures, hyperlinks
+and character styles they refer to. The chunks are stitched into the
+output in document order: the stitcher starts the column sections
+itself, from the first pass's categories, and relates each block's
+pictures and links to the output the way a fragment cache hit does
+(see fragment_cache.insert_output), so the result is the document
+process_docx would have written.
+"""
+import io
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from lxml import etree
+
+from classify import classify_blocks
+from document_template import new_document
+from formatter import (BlockRenderer, FormatOptions, configure_section, report_failure, save_output,
+                       section_change, start_section)
+from fragment_cache import W_SECTPR, insert_output, output_dependencies
+from heading_rules import load_rules
+from metrics import StageTimer
+from run_styles import RunStyles
+from streaming import W_BODY, SourceDocument, StreamingWriter
+
+# A chunk holds at least this much body XML, so it is worth the round trip to a worker
+CHUNK_MIN_BYTES = 256 * 1024
+# Chunks to aim for per worker, so one slow chunk does not leave the others idle
+CHUNKS_PER_WORKER = 2
+# Categories a chunk may start with, besides any block that switches columns
+CHUNK_BOUNDARIES = ('title', 'heading', 'references_heading')
+# Without a boundary, a chunk is cut anyway once it is this many times the target size
+CHUNK_MAX_FACTOR = 4
+
+# xml: the chunk's body children inside a w:body element
+# title_found, in_references: the classifier state before its first block
+# categories: each block's category from the first pass, for the stitcher's sections
+Chunk = namedtuple('Chunk', ['xml', 'title_found', 'in_references', 'categories'])
+
+# xml: the output elements of every block inside a w:body element
+# sizes: how many of those elements each block produced, in order
+# dependencies: (rels, styles) of each block's output, as fragment_cache.output_dependencies returns them
+# stats: the worker's StageTimer dict with its image bytes
+RenderedChunk = namedtuple('RenderedChunk', ['xml', 'sizes', 'dependencies', 'stats'])
+
+_BODY_START = f'<w:body {nsdecls("w")}>'.encode('utf-8')
+_BODY_END = b'</w:body>'
+
+
+def plan_chunks(doc, chunk_bytes, rules=None, rule_stats=None):
+    """
+    Classify the body of SourceDocument *doc* and yield it as Chunks of about *chunk_bytes*
+    of XML. A chunk ends before a body child whose first block switches columns or starts a
+    heading once it is at least *chunk_bytes*, or before any child once it is
+    CHUNK_MAX_FACTOR times that.
+    """
+    parts, categories, size = [], [], 0
+    title_found = in_references = False
+    state = (title_found, in_references)
+    columns = 1
+    child = None
+    for block in classify_blocks(doc.iter_blocks(), rules, rule_stats):
+        # Blocks in text boxes and content controls go with the body child that holds them
+        top = block.element
+        while top.getparent().tag != W_BODY:
+            top = top.getparent()
+        new_child = top is not child
+        child = top
+
+        new_columns = section_change(block.category, columns)
+        if new_child and parts and (size >= chunk_bytes * CHUNK_MAX_FACTOR or size >= chunk_bytes and (
+                new_columns is not None or block.category in CHUNK_BOUNDARIES)):
+            yield Chunk(b''.join([_BODY_START] + parts + [_BODY_END]), *state, categories)
+            parts, categories, size = [], [], 0
+            state = (title_found, in_references)
+
+        if new_child:
+            # iter_blocks() drops the element once the next one is read, so it is kept as XML
+            xml = etree.tostring(top)
+            parts.append(xml)
+            size += len(xml)
+        categories.append(block.category)
+        columns = new_columns or columns
+        if block.category == 'references_heading':
+            in_references = True
+        elif block.category == 'title':
+            title_found = True
+
+    if parts:
+        yield Chunk(b''.join([_BODY_START] + parts + [_BODY_END]), *state, categories)
+
+
+def format_chunk(input_path, chunk, options=None):
+    """
+    Classify and render *chunk* of the DOCX at *input_path* and return a RenderedChunk
+    (process pool entry point). Only the parts the chunk uses are read from the file.
+    *options* is a formatter.FormatOptions; its run formatting, picture and template
+    settings apply as in process_docx.
+    """
+    options = options or FormatOptions()
+    timer = StageTimer()
+    doc = SourceDocument(input_path)
+    try:
+        new_doc = new_document(options.template)
+        # Tables copied cell by cell are as wide as the page's margins allow
+        configure_section(new_doc.sections[0])
+        run_styles = RunStyles(new_doc, doc.part._styles_part.element) if options.preserve_formatting else None
+        renderer = BlockRenderer(doc, new_doc, timer, None, options.image_dpi, options.template, run_styles)
+        image_blob = lambda r_id: new_doc.part.related_parts[r_id].blob
+        body = new_doc.element.body
+        # Whatever the template's body holds stays ahead of the chunk's output
+        start = len(body) - (1 if len(body) and body[-1].tag == W_SECTPR else 0)
+
+        parts, sizes, dependencies = [_BODY_START], [], []
+        blocks = classify_blocks(parse_xml(chunk.xml), load_rules(options.heading_rules),
+                                 title_found=chunk.title_found, in_references=chunk.in_references)
+        for block in timer.timed_iter('classify', blocks):
+            timer.count('blocks')
+            if block.container != 'body':
+                timer.count(f'{block.container}_blocks')
+            renderer.render(block)
+
+            with timer.stage('capture'):
+                # Take the block's output out of the body, so the body only ever holds one block
+                elements = [el for el in body[start:] if el.tag != W_SECTPR]
+                dependency = output_dependencies(elements, new_doc.part, image_blob, run_styles)
+                if dependency is None:
+                    raise ValueError('Chunk output refers to a part that cannot be related again')
+                for el in elements:
+                    body.remove(el)
+                    parts.append(etree.tostring(el))
+                sizes.append(len(elements))
+                dependencies.append(dependency)
+        parts.append(_BODY_END)
+
+        stats = timer.as_dict()
+        stats['image_bytes_in'] = renderer.image_bytes_in
+        stats['image_bytes_out'] = renderer.image_bytes_out
+        return RenderedChunk(b''.join(parts), sizes, dependencies, stats)
+    finally:
+        doc.close()
+
+
+def _input_path(input_file, workspace=None):
+    """
+    Return (path, temporary) for *input_file*. Bytes and file objects are written to a
+    temporary file, kept in *workspace* with its size reserved when one is given.
+    """
+    if isinstance(input_file, (str, os.PathLike)):
+        return os.fspath(input_file), False
+    data = input_file if isinstance(input_file, (bytes, bytearray)) else input_file.read()
+    directory = None
+    if workspace is not None:
+        workspace.reserve(len(data))
+        directory = workspace.directory()
+    fd, path = tempfile.mkstemp(prefix='docx-parallel-', suffix='.docx', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path, True
+
+
+def process_docx_parallel(input_file, output_file=None, footer_text="", options=None, executor=None,
+                          workers=None, stats=None, workspace=None):
+    """
+    Format a DOCX like formatter.process_docx, with the body classified and rendered in
+    chunks on *executor* (a concurrent.futures executor running processes), or on a
+    process pool of *workers* processes made for the call. Inputs, results and *stats*
+    are as for process_docx, with the settings taken from *options*, a FormatOptions.
+    The output is written with the streaming backend when the input is at least
+    options.streaming_min_size. The fragment cache is not used. The workers read the
+    input from its path, so input bytes or a file object are first written to a
+    temporary file, removed when the call returns. Given a workspace.Workspace as
+    *workspace*, that file is made there and its size reserved against the quota;
+    QuotaExceededError is raised when the quota has no room for it.
+    """
+    options = options or FormatOptions()
+    timer = StageTimer()
+    doc = writer = pool = None
+    pending = []
+    # Made before the try, so a full quota reaches the caller as workspace.QuotaExceededError
+    with timer.stage('open'):
+        input_path, temporary = _input_path(input_file, workspace)
+    try:
+        # Open the document; only the body is read here, the workers load the rest from the same file
+        with timer.stage('open'):
+            doc = SourceDocument(input_path, body_only=True)
+
+        with timer.stage('setup'):
+            new_doc = new_document(options.template)
+            configure_section(new_doc.sections[0], columns=1, footer_text=footer_text)
+            if os.path.getsize(input_path) >= options.streaming_min_size:
+                output = io.BytesIO() if output_file is None else output_file
+                writer = StreamingWriter(new_doc, output)
+        dest = writer or new_doc.part
+        current_columns = 1
+        section_count = 1
+
+        if executor is None:
+            executor = pool = ProcessPoolExecutor(max_workers=workers)
+        workers = workers or getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+        chunk_bytes = max(CHUNK_MIN_BYTES, doc.body_size // (workers * CHUNKS_PER_WORKER))
+        rule_stats = {} if stats is not None else None
+        run_styles = RunStyles(new_doc) if options.preserve_formatting else None
+
+        # Chunks go to the pool as soon as they are cut, so the workers start while the plan is made
+        chunks = plan_chunks(doc, chunk_bytes, load_rules(options.heading_rules), rule_stats)
+        for chunk in timer.timed_iter('plan', chunks):
+            pending.append((chunk.categories, executor.submit(format_chunk, input_path, chunk, options)))
+            timer.count('chunks')
+
+        image_bytes_in = image_bytes_out = 0
+        for categories, future in pending:
+            with timer.stage('wait'):
+                rendered = future.result()
+            with timer.stage('stitch'):
+                elements = list(parse_xml(rendered.xml))
+            index = 0
+            for category, size, (rels, styles) in zip(categories, rendered.sizes, rendered.dependencies):
+                columns = section_change(category, current_columns)
+                if columns is not None:
+                    with timer.stage('sections'):
+                        start_section(new_doc, columns=columns)
+                    current_columns = columns
+                    section_count += 1
+                with timer.stage('stitch'):
+                    insert_output(elements[index:index + size], rels, styles, new_doc, dest, run_styles)
+                index += size
+            if writer is not None:
+                with timer.stage('write'):
+                    writer.flush()
+
+            # The workers' stages add up to the CPU time they spent, not to wall time
+            for name, seconds in rendered.stats['stages'].items():
+                timer.add(name, seconds)
+            for name, n in rendered.stats['counts'].items():
+                timer.count(name, n)
+            image_bytes_in += rendered.stats['image_bytes_in']
+            image_bytes_out += rendered.stats['image_bytes_out']
+
+        timer.count('sections', section_count)
+        if run_styles is not None:
+            timer.count('run_styles', len(run_styles))
+
+        result = save_output(timer, new_doc, output_file, writer, (image_bytes_in, image_bytes_out),
+                             rule_stats, stats)
+        if stats is not None:
+            stats['workers'] = workers
+        return result
+    except Exception as e:
+        for _, future in pending:
+            future.cancel()
+        report_failure(e, writer)
+        return None if output_file is None else False
+    finally:
+        if doc is not None:
+            doc.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if temporary:
+            os.remove(input_path)
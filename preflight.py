@@ -0,0 +1,105 @@
+"""
+Dry-run analysis: the layout process_docx would give a document, without formatting it.
+
+plan_layout() streams word/document.xml through the same classifier as
+process_docx and applies the same column rules, but builds no output
+document, loads no styles or relationships and extracts no images. It
+returns a JSON-serializable plan with one entry per block, the sections
+the output would have and summary counts, so uploads can be checked and
+routed before committing to a full format.
+"""
+import io
+import time
+from collections import Counter
+
+from classify import classify_blocks
+from formatter import section_change
+from heading_rules import load_rules
+from streaming import SourceDocument
+
+# Block text is cut to this many characters in the plan
+PREVIEW_LENGTH = 80
+
+
+def _preview(text):
+    if len(text) <= PREVIEW_LENGTH:
+        return text
+    return text[:PREVIEW_LENGTH - 1] + '…'
+
+
+def plan_layout(input_file, heading_rules=None):
+    """
+    Return the layout plan of the DOCX *input_file* (a path, binary file-like object or bytes).
+
+    Each entry of plan['blocks'] gives the block's kind, where it sits (the
+    body, or a content control or text box, and how deep), category, the
+    heading rule that decided it, a text preview, the number of pictures it
+    holds and the output section it lands in (None for empty paragraphs,
+    which are dropped). A block that starts a new section has
+    'section_break' set. plan['sections'] lists each section's column
+    count and first block, and plan['rules'] the hits and matching seconds
+    of each heading rule. *heading_rules* is as for process_docx.
+    """
+    start = time.perf_counter()
+    if isinstance(input_file, (bytes, bytearray)):
+        input_file = io.BytesIO(input_file)
+
+    blocks = []
+    # process_docx always opens with a 1-column section
+    sections = [{'index': 0, 'columns': 1, 'first_block': None}]
+    categories = Counter()
+    images = 0
+    title = None
+    rules = load_rules(heading_rules)
+    rule_stats = {}
+
+    source = SourceDocument(input_file, body_only=True)
+    try:
+        for index, block in enumerate(classify_blocks(source.iter_blocks(), rules, rule_stats)):
+            category = block.category
+            categories[category] += 1
+            images += len(block.r_ids)
+            if category == 'title' and title is None:
+                title = block.text
+
+            entry = {
+                'index': index,
+                'kind': block.kind,
+                'container': block.container,
+                'depth': block.depth,
+                'category': category,
+                'rule': block.rule,
+                'text': _preview(block.text),
+                'images': len(block.r_ids),
+                'section': None,
+                'section_break': False,
+            }
+            if category != 'empty':
+                section = sections[-1]
+                columns = section_change(category, section['columns'])
+                if columns is not None:
+                    section = {'index': len(sections), 'columns': columns, 'first_block': None}
+                    sections.append(section)
+                    entry['section_break'] = True
+                if section['first_block'] is None:
+                    section['first_block'] = index
+                entry['section'] = section['index']
+            blocks.append(entry)
+    finally:
+        source.close()
+
+    return {
+        'blocks': blocks,
+        'sections': sections,
+        'summary': {
+            'title': title,
+            'blocks': len(blocks),
+            'paragraphs': len(blocks) - categories['table'],
+            'tables': categories['table'],
+            'images': images,
+            'sections': len(sections),
+            'categories': dict(categories),
+        },
+        'rules': rule_stats,
+        'seconds': round(time.perf_counter() - start, 4),
+    }
@@ -0,0 +1,176 @@
+"""
+Content-addressed cache of formatted documents.
+
+Results are keyed by a hash of the input bytes, the footer text and the
+formatter version, and kept either in memory or in a directory on disk
+under a byte budget with least-recently-used eviction. Concurrent misses
+for the same key are collapsed so only one caller runs the formatter.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def cache_key(data, footer_text="", version=""):
+    """Return the cache key for formatting *data* with *footer_text* under formatter *version*"""
+    digest = hashlib.sha256()
+    for part in (version.encode(), footer_text.encode('utf-8'), data):
+        # Length-prefix each part so boundaries between them cannot shift
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU store of formatted documents, in memory or under *directory*"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+        self.size = 0
+        self._entries = OrderedDict()  # key -> bytes in memory, or size on disk
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_directory()
+
+    def _load_directory(self):
+        # Oldest files first so they are the first to be evicted
+        paths = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif os.path.isfile(path):
+                paths.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        for _, key, size in sorted(paths):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the cached result for *key*, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if not self.directory:
+                return entry
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            # Removed behind our back; forget it
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    self.size -= entry
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Store *value* under *key*, evicting least recently used results to stay in budget.
+        A result that cannot be written to the cache directory is left uncached.
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        if self.directory:
+            tmp_path = self._path(key) + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(value)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                # A full disk, or the .tmp file swept by another process; the result itself is fine
+                print(f"Could not cache result {key}: {e}")
+                with self._lock:
+                    self.write_errors += 1
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old if self.directory else len(old)
+            self._entries[key] = size if self.directory else value
+            self.size += size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            if self.directory:
+                self.size -= entry
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            else:
+                self.size -= len(entry)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the result for *key*, calling ``compute()`` on a miss.
+
+        If another thread is already computing the same key, wait for its
+        result instead of computing it again. Failures are not cached.
+        """
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+            self.put(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        """Return the hit/miss/eviction counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'write_errors': self.write_errors,
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
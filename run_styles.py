@@ -0,0 +1,228 @@
+"""
+Run formatting preservation through interned character styles.
+
+By default process_docx writes each body paragraph and reference as one
+plain run, dropping the source's inline formatting. With
+preserve_formatting the runs are rebuilt instead. The properties listed
+in PRESERVED_PROPERTIES are read from each source run. Each distinct set
+becomes one generated character style in the output, named after what it
+does (e.g. "Run Bold Italic"), and runs refer to it with a single
+w:rStyle rather than repeating the properties. A run formatted through
+one of the source's own character styles (Strong, Emphasis) keeps what
+that style and the styles it is based on set, with the run's direct
+properties on top. Adjacent runs that end up with the same style are
+merged. Font sizes, languages and proofing marks are left to the template.
+"""
+import re
+
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml.ns import qn
+from lxml import etree
+
+from classify import W_BR, W_R, W_T, W_TAB, run_text
+
+W_RPR = qn('w:rPr')
+W_RSTYLE = qn('w:rStyle')
+W_VAL = qn('w:val')
+W_HINT = qn('w:hint')
+XML_SPACE = qn('xml:space')
+
+# Run properties kept from the source, as {tag: label for style names}
+PRESERVED_PROPERTIES = {
+    qn('w:rFonts'): None,  # Labelled with the font's name
+    qn('w:b'): 'Bold',
+    qn('w:bCs'): None,
+    qn('w:i'): 'Italic',
+    qn('w:iCs'): None,
+    qn('w:caps'): 'All Caps',
+    qn('w:smallCaps'): 'Small Caps',
+    qn('w:strike'): 'Strikethrough',
+    qn('w:dstrike'): 'Double Strikethrough',
+    qn('w:color'): None,  # Labelled with the colour
+    qn('w:highlight'): 'Highlight',
+    qn('w:u'): 'Underline',
+    qn('w:vertAlign'): None,  # Labelled Superscript or Subscript
+}
+TOGGLES = {qn('w:b'), qn('w:bCs'), qn('w:i'), qn('w:iCs'), qn('w:caps'), qn('w:smallCaps'),
+           qn('w:strike'), qn('w:dstrike')}
+# Values that switch a property off, which is what leaving it out already does
+OFF_VALUES = {
+    qn('w:u'): ('none',),
+    qn('w:vertAlign'): ('baseline',),
+    qn('w:highlight'): ('none',),
+    qn('w:color'): ('auto',),
+}
+TOGGLE_OFF = ('0', 'false', 'off')
+_TEXT_BREAKS = re.compile(r'([\t\n\r])')
+
+
+def _apply_properties(properties, rPr):
+    # Each property *rPr* sets replaces the one in *properties*, and one it switches off is removed
+    for child in rPr:
+        tag = child.tag
+        if tag not in PRESERVED_PROPERTIES:
+            continue
+        val = child.get(W_VAL)
+        if tag in TOGGLES:
+            if val in TOGGLE_OFF:
+                properties.pop(tag, None)
+            else:
+                # <w:b/>, <w:b w:val="1"/> and <w:b w:val="true"/> are the same property
+                properties[tag] = ()
+            continue
+        if val in OFF_VALUES.get(tag, ()):
+            properties.pop(tag, None)
+            continue
+        properties[tag] = tuple(sorted((name, value) for name, value in child.attrib.items() if name != W_HINT))
+
+
+def run_properties_key(rPr, style_properties=None):
+    """
+    Return the preserved properties of the w:rPr element *rPr* as a hashable key,
+    ((tag, ((attribute, value), ...)), ...) in document order, or None if there are none.
+    *style_properties* is the {tag: attributes} the run's character style sets, which
+    the direct properties in *rPr* override.
+    """
+    properties = dict(style_properties or {})
+    if rPr is not None:
+        _apply_properties(properties, rPr)
+    return tuple(properties.items()) or None
+
+
+def _style_label(key):
+    labels = []
+    for tag, attrib in key:
+        attrib = dict(attrib)
+        label = PRESERVED_PROPERTIES[tag]
+        if tag == qn('w:rFonts'):
+            label = attrib.get(qn('w:ascii')) or attrib.get(qn('w:hAnsi')) or attrib.get(qn('w:cs'))
+        elif tag == qn('w:vertAlign'):
+            label = attrib.get(W_VAL, '').capitalize()
+        elif tag == qn('w:color'):
+            label = f"#{attrib.get(W_VAL, '')}"
+        if label and label not in labels:
+            labels.append(label)
+    return 'Run ' + ' '.join(labels) if labels else 'Run Formatting'
+
+
+class RunStyles:
+    """
+    The character styles generated in one output document, one per distinct set of run
+    properties. *source_styles* is the w:styles element of the document the runs come
+    from, to resolve the character styles they refer to.
+    """
+
+    def __init__(self, doc, source_styles=None):
+        self.doc = doc
+        self.source_styles = source_styles
+        self._style_ids = {}  # properties key -> style ID
+        self._keys = {}  # style ID -> properties key
+        self._source_properties = {}  # source character style ID -> {tag: attributes} it sets
+
+    def __len__(self):
+        return len(self._style_ids)
+
+    def style_id(self, rPr):
+        """Return the style ID for the run properties *rPr*, adding the style on first use; None if plain"""
+        style = rPr.find(W_RSTYLE) if rPr is not None else None
+        style_properties = self.style_properties(style.get(W_VAL)) if style is not None else None
+        key = run_properties_key(rPr, style_properties)
+        if key is None:
+            return None
+        return self.style_id_for_key(key)
+
+    def style_properties(self, style_id):
+        """Return the {tag: attributes} source character style *style_id* sets, its basedOn chain included"""
+        properties = self._source_properties.get(style_id)
+        if properties is None:
+            chain = []
+            style = self.source_styles.get_by_id(style_id) if self.source_styles is not None else None
+            while style is not None and style not in chain and style.type == WD_STYLE_TYPE.CHARACTER:
+                chain.append(style)
+                style = self.source_styles.get_by_id(style.basedOn_val) if style.basedOn_val else None
+            properties = {}
+            for style in reversed(chain):
+                if style.rPr is not None:
+                    _apply_properties(properties, style.rPr)
+            self._source_properties[style_id] = properties
+        return properties
+
+    def style_id_for_key(self, key):
+        style_id = self._style_ids.get(key)
+        if style_id is None:
+            style_id = self._style_ids[key] = self._add_style(key)
+            self._keys[style_id] = key
+        return style_id
+
+    def key(self, style_id):
+        """Return the properties key of a style this object generated, or None for any other style"""
+        return self._keys.get(style_id)
+
+    def _add_style(self, key):
+        styles = self.doc.styles.element
+        base_name = name = _style_label(key)
+        n = 1
+        # Keep clear of the template's own styles and of labels shared by different properties
+        while styles.get_by_name(name) is not None or styles.get_by_id(name.replace(' ', '')) is not None:
+            n += 1
+            name = f"{base_name} {n}"
+        style = styles.add_style_of_type(name, WD_STYLE_TYPE.CHARACTER, builtin=False)
+        if styles.get_by_id('DefaultParagraphFont') is not None:
+            style.basedOn_val = 'DefaultParagraphFont'
+        rPr = style.get_or_add_rPr()
+        for tag, attrib in key:
+            rPr.append(rPr.makeelement(tag, dict(attrib)))
+        return style.styleId
+
+
+def append_text(r, text):
+    """
+    Add *text* to the w:r element *r* the way python-docx's Run.text does, tabs and
+    line breaks included. The elements are appended directly rather than through
+    python-docx's ordered insertion, so *r* must not already end in anything else.
+    """
+    for part in _TEXT_BREAKS.split(text):
+        if part == '\t':
+            etree.SubElement(r, W_TAB)
+        elif part in ('\n', '\r'):
+            etree.SubElement(r, W_BR)
+        elif part:
+            t = etree.SubElement(r, W_T)
+            t.text = part
+            if len(part.strip()) < len(part):
+                t.set(XML_SPACE, 'preserve')
+
+
+def append_styled_runs(p, src_p, run_styles):
+    """
+    Add the text of the source paragraph *src_p* to the w:p element *p* as runs carrying
+    *run_styles* character styles, merging neighbours with the same style. Leading and
+    trailing whitespace of the paragraph is dropped, as in the classifier's text.
+    """
+    segments = []  # [style ID, [text, ...]]
+    for r in src_p.iterchildren(W_R):
+        text = run_text(r)
+        if not text:
+            continue
+        style_id = run_styles.style_id(r.find(W_RPR))
+        if segments and segments[-1][0] == style_id:
+            segments[-1][1].append(text)
+        else:
+            segments.append([style_id, [text]])
+
+    segments = [(style_id, ''.join(parts)) for style_id, parts in segments]
+    while segments and not segments[0][1].strip():
+        segments.pop(0)
+    while segments and not segments[-1][1].strip():
+        segments.pop()
+    if not segments:
+        return
+    segments[0] = (segments[0][0], segments[0][1].lstrip())
+    segments[-1] = (segments[-1][0], segments[-1][1].rstrip())
+
+    # New runs go at the end of *p*, so they are appended directly
+    for style_id, text in segments:
+        r = etree.SubElement(p, W_R)
+        if style_id is not None:
+            etree.SubElement(etree.SubElement(r, W_RPR), W_RSTYLE, {W_VAL: style_id})
+        append_text(r, text)
@@ -0,0 +1,250 @@
+"""
+Streaming DOCX input and output for very large documents.
+
+SourceDocument reads word/document.xml with an incremental pull parser and
+hands out the body's paragraphs and tables one at a time, dropping each
+one once the next is requested; every other part stays in the input zip
+until it is actually used. StreamingWriter serializes the output body
+into word/document.xml block by block as it is built. Between them,
+memory stays roughly flat however long the document is.
+"""
+import shutil
+import tempfile
+import zipfile
+
+from lxml import etree
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+from docx.opc.part import Part, PartFactory
+from docx.opc.pkgreader import _ContentTypeMap, _SerializedRelationships
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.oxml import element_class_lookup
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.parts.document import DocumentPart
+
+from classify import W_P, W_TBL
+from traverse import W_SDT
+
+W_BODY = qn('w:body')
+W_SECTPR = qn('w:sectPr')
+READ_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class _ZipPart(Part):
+    """A part whose bytes are read from the input zip only when they are asked for"""
+
+    def __init__(self, partname, content_type, archive):
+        super().__init__(partname, content_type)
+        self._archive = archive
+
+    @property
+    def blob(self):
+        return self._archive.read(self.partname.membername)
+
+
+class SourceDocument:
+    """
+    Read-only view of an input DOCX whose body is parsed incrementally.
+    *part* behaves like python-docx's document part for styles and
+    relationships, so Table(element, source) and load_embedded_image work.
+    With *body_only* the relationships and styles are not loaded at all,
+    for callers that only look at the body's text.
+    """
+
+    def __init__(self, input_file, body_only=False):
+        self._archive = zipfile.ZipFile(input_file)
+        try:
+            self._content_types = _ContentTypeMap.from_xml(self._archive.read(CONTENT_TYPES_URI.membername))
+            package_rels = self._load_rels(PACKAGE_URI)
+            main = next(srel for srel in package_rels if srel.reltype == RT.OFFICE_DOCUMENT)
+            self.partname = main.target_partname
+
+            # The body is streamed by iter_blocks() rather than held by the part
+            self.part = DocumentPart(self.partname, self._content_types[self.partname], None, None)
+            for srel in () if body_only else self._load_rels(self.partname):
+                if srel.is_external:
+                    self.part.load_rel(srel.reltype, srel.target_ref, srel.rId, is_external=True)
+                else:
+                    self.part.load_rel(srel.reltype, self._load_part(srel), srel.rId)
+        except Exception:
+            self._archive.close()
+            raise
+
+    def _load_rels(self, partname):
+        try:
+            xml = self._archive.read(partname.rels_uri.membername)
+        except KeyError:
+            xml = None
+        return _SerializedRelationships.load_from_xml(partname.baseURI, xml)
+
+    def _load_part(self, srel):
+        partname = srel.target_partname
+        content_type = self._content_types[partname]
+        if srel.reltype == RT.STYLES:
+            # Styles are needed to copy tables; everything else is read on demand
+            return PartFactory(partname, content_type, srel.reltype,
+                               self._archive.read(partname.membername), None)
+        return _ZipPart(partname, content_type, self._archive)
+
+    @property
+    def body_size(self):
+        """Uncompressed size of the main document part, in bytes"""
+        return self._archive.getinfo(self.partname.membername).file_size
+
+    def iter_blocks(self):
+        """Yield each w:p, w:tbl and w:sdt child of the body in order, dropping it when the next one is requested"""
+        # Only block ends are reported, so lxml skips the Python round trip for every run and text node
+        parser = etree.XMLPullParser(events=('end',), tag=(W_P, W_TBL, W_SDT), remove_blank_text=True,
+                                     resolve_entities=False)
+        parser.set_element_class_lookup(element_class_lookup)
+        with self._archive.open(self.partname.membername) as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+                for _, el in parser.read_events():
+                    body = el.getparent()
+                    if body is None or body.tag != W_BODY:
+                        # Nested in a table cell, content control or text box; walked with its block
+                        continue
+                    yield el
+                    # Drop the block, and anything before it that is not a block (e.g. bookmarks)
+                    el.clear()
+                    while el.getprevious() is not None:
+                        del body[0]
+                    body.remove(el)
+                if not chunk:
+                    break
+
+    def close(self):
+        self._archive.close()
+
+
+class StreamingWriter:
+    """
+    Write the body of python-docx Document *doc* to *output_file* as it is built.
+
+    Blocks are added to *doc* as usual; flush() moves them out of its body
+    into word/document.xml, so the body only ever holds the block being
+    built. Pictures go straight into the output zip. The remaining parts
+    (styles, footers, settings) are taken from *doc* by close().
+    """
+
+    def __init__(self, doc, output_file, spool_max_size=SPOOL_MAX_SIZE):
+        self.doc = doc
+        self.output_file = output_file
+        self._archive = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED)
+        # The zip takes one open member at a time, so the body is spooled and added last
+        self._document_xml = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        self._image_numbers = {int(part.partname.idx) for part in doc.part.package.iter_parts()
+                               if part.partname.startswith('/word/media/image') and part.partname.idx}
+        self._written = set()
+        self._images = {}  # SHA-1 -> rId
+        self._block_images = {}  # rId -> bytes of the pictures added since the last flush()
+        self._max_id = 0
+
+        # The document and body tags, serialized the way python-docx saves a whole part, around a marker
+        root = doc.element
+        shell = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+        etree.SubElement(shell, root.body.tag).append(etree.Comment('body'))
+        head, self._tail = etree.tostring(shell, encoding='UTF-8', standalone=True).split(b'<!--body-->')
+        self._document_xml.write(head)
+        # The root declares these, so blocks need not repeat them
+        self._declarations = [f' xmlns:{prefix}="{uri}"'.encode() if prefix else f' xmlns="{uri}"'.encode()
+                              for prefix, uri in root.nsmap.items()]
+
+    @property
+    def next_id(self):
+        """Next free shape ID, counting blocks already written the way python-docx's next_id would"""
+        return max(self._max_id, self.doc.part.next_id - 1) + 1
+
+    def flush(self):
+        """Write every finished block in the body and remove it from the body"""
+        body = self.doc.element.body
+        for child in list(body):
+            if child.tag == W_SECTPR:
+                continue
+            ids = [int(value) for value in child.xpath('.//@id') if value.isdigit()]
+            if ids:
+                self._max_id = max(self._max_id, max(ids))
+            body.remove(child)
+            self._write(child)
+        self._block_images = {}
+
+    def _write(self, element):
+        # An element serialized on its own declares every namespace in scope on its start tag
+        xml = etree.tostring(element, encoding='UTF-8')
+        end = xml.index(b'>')
+        start_tag = xml[:end]
+        for declaration in self._declarations:
+            start_tag = start_tag.replace(declaration, b'', 1)
+        self._document_xml.write(start_tag)
+        self._document_xml.write(xml[end:])
+
+    def get_or_add_image(self, image_descriptor):
+        """Like DocumentPart.get_or_add_image, but the image is written to the output zip right away"""
+        image = Image.from_file(image_descriptor)
+        r_id = self._images.get(image.sha1)
+        if r_id is None:
+            # Numbered like python-docx's image parts: lowest free number, whatever the extension
+            number = 1
+            while number in self._image_numbers:
+                number += 1
+            self._image_numbers.add(number)
+            partname = PackURI(f'/word/media/image{number}.{image.ext}')
+            self._archive.writestr(partname.membername, image.blob)
+            self._written.add(partname)
+            # The part only carries the name and content type; its bytes are already written
+            r_id = self.relate_to(Part(partname, image.content_type), RT.IMAGE)
+            self._images[image.sha1] = r_id
+        self._block_images[r_id] = image.blob
+        return r_id, image
+
+    def image_blob(self, r_id):
+        """Return the bytes of picture *r_id*, if it was added since the last flush()"""
+        return self._block_images[r_id]
+
+    def add_picture(self, run, image_descriptor, width, height):
+        """Like Run.add_picture, with the image written through get_or_add_image"""
+        r_id, image = self.get_or_add_image(image_descriptor)
+        cx, cy = image.scaled_dimensions(width, height)
+        run._r.add_drawing(CT_Inline.new_pic_inline(self.next_id, r_id, image.filename, cx, cy))
+
+    def relate_to(self, target, reltype, is_external=False):
+        return self.doc.part.relate_to(target, reltype, is_external=is_external)
+
+    def close(self):
+        """Write the rest of the body and the other parts, and finish the package"""
+        self.flush()
+        sectPr = self.doc.element.body.sectPr
+        if sectPr is not None:
+            self._write(sectPr)
+        self._document_xml.write(self._tail)
+
+        main = self.doc.part
+        self._document_xml.seek(0)
+        with self._archive.open(main.partname.membername, 'w') as f:
+            shutil.copyfileobj(self._document_xml, f)
+        self._document_xml.close()
+
+        parts = list(main.package.iter_parts())
+        self._archive.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+        self._archive.writestr(PACKAGE_URI.rels_uri.membername, main.package.rels.xml)
+        for part in parts:
+            if part is not main and part.partname not in self._written:
+                self._archive.writestr(part.partname.membername, part.blob)
+            if len(part.rels):
+                self._archive.writestr(part.partname.rels_uri.membername, part.rels.xml)
+        self._archive.close()
+
+    def abort(self):
+        """Give up on the package, e.g. after an error while formatting"""
+        try:
+            self._document_xml.close()
+        finally:
+            self._archive.close()
@@ -0,0 +1,87 @@
+"""
+Document-order traversal of block content at any depth.
+
+A body holds more than its direct w:p and w:tbl children. Content
+controls (w:sdt) wrap paragraphs and tables, table cells hold paragraphs
+and further tables, and text boxes anchored in a paragraph's runs hold
+paragraphs and tables of their own. walk() visits all of them in one
+pass over the lxml tree. lxml's iterwalk filters the tags in C, so the
+runs and text in between never become Python objects, and each item
+carries its depth and the container it sits in. Recursing through
+python-docx's wrappers instead is quadratic on large tables, since every
+row's cells are found by building the table's whole cell grid again.
+"""
+from collections import namedtuple
+
+from docx.oxml.ns import qn
+from lxml import etree
+
+W_P = qn('w:p')
+W_TBL = qn('w:tbl')
+W_TC = qn('w:tc')
+W_SDT = qn('w:sdt')
+W_SDT_CONTENT = qn('w:sdtContent')
+W_TXBX_CONTENT = qn('w:txbxContent')
+# Word writes each text box twice, as DrawingML and as a VML fallback; only the first is visited
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+
+# Parents under which a w:sdt wraps blocks, rather than runs or table cells
+BLOCK_PARENTS = {qn('w:body'), W_TC, W_SDT_CONTENT, W_TXBX_CONTENT}
+
+# kind: 'paragraph', 'table', 'cell', 'sdt' or 'textbox' (a text box's w:txbxContent)
+# element: the item's element
+# depth: how many cells, content controls and text boxes below the root enclose the item
+# container: the kind of the innermost of those, or 'body' at the root's own level
+# container_element: its element (the w:tc, w:sdt or w:txbxContent), or the root
+Item = namedtuple('Item', ['kind', 'element', 'depth', 'container', 'container_element'])
+
+_KINDS = {W_P: 'paragraph', W_TBL: 'table', W_TC: 'cell', W_SDT: 'sdt', W_TXBX_CONTENT: 'textbox'}
+_CONTAINERS = (W_TC, W_SDT, W_TXBX_CONTENT)
+
+
+def walk(root, tables=True, text_boxes=True):
+    """
+    Yield an Item for *root* and every paragraph, table, cell, block-level content control
+    and text box under it, in document order, each before anything it contains. *root* is
+    usually a w:body or a block; it is yielded, at depth 0, only if it is one of those items.
+    With *tables* False tables are yielded but not entered, and with *text_boxes* False text
+    boxes are neither yielded nor entered.
+    """
+    stack = [('body', root if root.tag not in _KINDS else root.getparent())]  # enclosing containers
+    walker = etree.iterwalk(root, events=('start', 'end'), tag=(W_P, W_TBL, W_TC, W_SDT, W_TXBX_CONTENT,
+                                                                MC_FALLBACK))
+    for event, el in walker:
+        tag = el.tag
+        if event == 'end':
+            if tag in _CONTAINERS and stack[-1][1] is el:
+                stack.pop()
+            continue
+
+        if tag == MC_FALLBACK or tag == W_TXBX_CONTENT and not text_boxes:
+            walker.skip_subtree()
+            continue
+        if tag == W_SDT and el is not root and el.getparent().tag not in BLOCK_PARENTS:
+            continue  # Wraps runs in a paragraph or cells in a row; its content is visited as usual
+
+        container, container_element = stack[-1]
+        yield Item(_KINDS[tag], el, len(stack) - 1, container, container_element)
+        if tag == W_TBL and not tables:
+            walker.skip_subtree()
+        elif tag in _CONTAINERS:
+            stack.append((_KINDS[tag], el))
+
+
+def block_items(element):
+    """
+    Yield the Items of the paragraphs and tables that *element*, a child of the body, stands
+    for, in document order: a paragraph followed by the paragraphs and tables of its text
+    boxes, a table (which is not entered), or the blocks inside a content control.
+    """
+    tag = element.tag
+    if tag == W_TBL or tag == W_P and next(element.iter(W_TXBX_CONTENT), None) is None:
+        # Nothing inside to visit, which is nearly every block
+        yield Item(_KINDS[tag], element, 0, 'body', element.getparent())
+        return
+    for item in walk(element, tables=False):
+        if item.kind == 'paragraph' or item.kind == 'table':
+            yield item
@@ -1,8 +1,8 @@
 from docx import Document
-from app import process_docx
+from formatter import process_docx
 import os
 
-def create_test_docx(path):
+def build_test_document():
     doc = Document()
     doc.add_paragraph("ARTICLE MAIN TITLE") # Main Heading (1-column)
     doc.add_paragraph("Keywords: Automation, Pharmaceutical") # Keywords (2-column)
@@ -18,7 +18,10 @@ def create_test_docx(path):
     table.cell(1, 0).text = "Data 1"
     table.cell(1, 1).text = "Data 2"
     
-    doc.save(path)
+    return doc
+
+def create_test_docx(path):
+    build_test_document().save(path)
 
 def verify_output(path):
     doc = Document(path)
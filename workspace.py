@@ -0,0 +1,308 @@
+"""
+Per-request scratch space on disk, under a quota.
+
+Request bodies larger than SPOOL_MAX_SIZE spill to disk. Each request
+gets a Workspace, a directory under one shared root that is created on
+first use and removed with everything in it when the request ends, so
+concurrent requests never share a path and nothing outlives its request.
+Before a request that may spill is accepted, the bytes it can put on
+disk are reserved against the quota. Reservations are files under the
+root, counted under a lock file, so the quota holds across every process
+sharing the root. Once they would exceed it, WorkspaceManager.open()
+raises QuotaExceededError and the caller should answer 503. A background
+sweeper removes the workspaces and reservations a killed process left
+behind once they are older than the TTL.
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: reservations are still shared, but two processes may admit at once
+    fcntl = None
+
+WORKSPACE_PREFIX = 'ws-'
+RESERVATIONS_DIR = '.reservations'  # One empty file per reservation, named <pid>-<id>-<bytes>
+LOCK_NAME = '.lock'
+
+
+class QuotaExceededError(Exception):
+    """Raised when a request's disk reservation would take the workspaces past their quota"""
+
+
+class SpooledFile:
+    """
+    A file kept in memory until it grows past *max_size*, then moved into *workspace*.
+
+    Like tempfile.SpooledTemporaryFile, except that the rolled-over file has
+    a name inside the workspace, so its bytes are counted and swept.
+    """
+
+    def __init__(self, workspace, max_size):
+        self.workspace = workspace
+        self.max_size = max_size
+        self.path = None
+        self._file = io.BytesIO()
+
+    @property
+    def rolled(self):
+        return self.path is not None
+
+    def write(self, data):
+        if self.path is None and self._file.tell() + len(data) > self.max_size:
+            self.rollover()
+        return self._file.write(data)
+
+    def rollover(self):
+        if self.path is not None:
+            return
+        fd, self.path = tempfile.mkstemp(prefix='spool-', dir=self.workspace.directory())
+        memory = self._file
+        self._file = os.fdopen(fd, 'w+b')
+        self._file.write(memory.getbuffer())
+        self._file.seek(memory.tell())
+
+    def close(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Workspace:
+    """One request's directory under the manager's root, removed with its files by close()"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.reserved = 0
+        self.reservations = []  # paths of the reservation files holding *reserved*
+        self.path = None
+        self._files = []
+        self._closed = False
+
+    def directory(self):
+        """Return the workspace's directory, creating it on first use"""
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix=f'{WORKSPACE_PREFIX}{os.getpid()}-', dir=self.manager.root)
+            self.manager._track(self.path)
+        return self.path
+
+    def reserve(self, nbytes):
+        """Reserve *nbytes* more of the quota for files written here, or raise QuotaExceededError"""
+        self.reservations.append(self.manager._reserve(nbytes))
+        self.reserved += nbytes
+
+    def spooled_file(self, max_size):
+        """Return a new SpooledFile that moves into this workspace once it is larger than *max_size*"""
+        spool = SpooledFile(self, max_size)
+        self._files.append(spool)
+        return spool
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for spool in self._files:
+            spool.close()
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.manager._untrack(self.path)
+        self.manager._release(self.reserved, self.reservations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WorkspaceManager:
+    """
+    Hand out Workspaces under *root* within *quota_bytes* of reservations.
+
+    *root* defaults to a docx-formatter directory in the system temp dir and
+    may be shared by several processes; the quota covers the reservations
+    of all of them. Workspaces and reservations under it that no live
+    request of this process holds are removed by the sweeper once they are
+    *ttl* seconds old; it runs every *sweep_interval* seconds from the
+    first open() on. A *quota_bytes* of None or 0 admits every request.
+    """
+
+    def __init__(self, root=None, quota_bytes=1024 * 1024 * 1024, ttl=3600, sweep_interval=60):
+        self.root = os.path.abspath(root or os.path.join(tempfile.gettempdir(), 'docx-formatter'))
+        self.quota_bytes = quota_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.reserved = 0  # by this process's requests; reserved_bytes() counts every process's
+        self.opened = 0
+        self.rejected = 0
+        self.swept = 0
+        self._active = set()  # directories and reservation files of this process's open workspaces
+        self._sweeper = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._reservations = os.path.join(self.root, RESERVATIONS_DIR)
+        os.makedirs(self._reservations, exist_ok=True)
+
+    @contextmanager
+    def _root_lock(self):
+        # Serializes admission between the processes sharing the root, and between this process's threads
+        with self._lock, open(os.path.join(self.root, LOCK_NAME), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def reserved_bytes(self):
+        """Return the bytes reserved by every process sharing the root"""
+        total = 0
+        for name in os.listdir(self._reservations):
+            try:
+                total += int(name.rsplit('-', 1)[1])
+            except (IndexError, ValueError):
+                pass
+        return total
+
+    def open(self, reserve=0):
+        """Return a new Workspace holding *reserve* bytes of the quota, or raise QuotaExceededError"""
+        self._start_sweeper()
+        workspace = Workspace(self)
+        if reserve:
+            workspace.reserve(reserve)
+        with self._lock:
+            self.opened += 1
+        return workspace
+
+    def _reserve(self, nbytes):
+        # Returns the path of the new reservation file
+        with self._root_lock():
+            reserved = self.reserved_bytes()
+            if self.quota_bytes and reserved + nbytes > self.quota_bytes:
+                self.rejected += 1
+                raise QuotaExceededError(
+                    f"{reserved} of {self.quota_bytes} bytes already reserved, {nbytes} more requested")
+            path = os.path.join(self._reservations, f'{os.getpid()}-{uuid.uuid4().hex}-{nbytes}')
+            open(path, 'x').close()
+            self._active.add(path)
+            self.reserved += nbytes
+        return path
+
+    def _release(self, reserved, reservations=()):
+        for path in reservations:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Swept after the TTL
+        with self._lock:
+            self.reserved -= reserved
+            self._active.difference_update(reservations)
+
+    def _track(self, path):
+        with self._lock:
+            self._active.add(path)
+
+    def _untrack(self, path):
+        with self._lock:
+            self._active.discard(path)
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None or not self.sweep_interval:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='workspace-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Workspace sweep failed: {str(e)}")
+
+    def sweep(self, now=None):
+        """Remove abandoned workspaces and reservations older than the TTL; return how many workspaces were removed"""
+        cutoff = (now or time.time()) - self.ttl
+        with os.scandir(self._reservations) as entries:
+            for entry in entries:
+                with self._lock:
+                    if entry.path in self._active:
+                        continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime <= cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    continue
+
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.name.startswith(WORKSPACE_PREFIX) or not entry.is_dir(follow_symlinks=False):
+                    continue
+                with self._lock:
+                    if entry.path in self._active:
+                        continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                except OSError:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        with self._lock:
+            self.swept += removed
+        return removed
+
+    def disk_usage(self):
+        """Return the bytes currently stored under the root"""
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                try:
+                    total += os.lstat(os.path.join(directory, name)).st_size
+                except OSError:
+                    pass  # Removed while we walked
+        return total
+
+    def stats(self):
+        """Return the reservation, admission and sweep counters"""
+        on_disk = self.disk_usage()
+        reserved = self.reserved_bytes()
+        with self._lock:
+            return {
+                'active': len(self._active),
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'swept': self.swept,
+                'reserved_bytes': reserved,
+                'quota_bytes': self.quota_bytes,
+                'disk_bytes': on_disk,
+            }
+
+    def shutdown(self):
+        """Stop the sweeper thread"""
+        self._stopping.set()
+        if self._sweeper is not None:
+            self._sweeper.join()